@@ -0,0 +1,207 @@
+"""
+Нагрузочный тест API отзывов: приложение из main.py вызывается в том же процессе через ASGI-клиент
+
+Запуск:
+    python bench_reviews.py
+    python bench_reviews.py --sizes 10 1000 --requests 500 --concurrency 16 --storage sqlite
+    python bench_reviews.py --output bench.json
+
+Для каждого размера хранилище заполняется заранее во временной папке
+(настоящий reviews.json не трогается), после чего замеряются GET, POST,
+DELETE и смешанная нагрузка. Результат - пропускная способность и
+p50/p99 задержки, печатается таблицей и сохраняется в JSON, чтобы
+сравнивать запуски до и после изменений хранилища.
+"""
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+# Лимиты частоты запросов мешают замерам, отключаем их до импорта приложения
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+import httpx
+
+import main
+from response_cache import ResponseCache
+from review_store import JsonLogStorage, ReviewStore, ReviewWriter, SqliteStorage, new_review_id
+
+DEFAULT_SIZES = [10, 1_000, 10_000, 100_000]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург"]
+
+
+def make_review(i: int) -> dict:
+    return {
+        "name": f"Пользователь {i}",
+        "handle": f"user{i}",
+        "city": CITIES[i % len(CITIES)],
+        "avatar": "",
+        "rating": i % 5 + 1,
+        "text": f"Отзыв номер {i}: питание понравилось, порции большие, доставка вовремя.",
+        "date": "01.01.2026",
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: List[float], elapsed: float, statuses: Dict[int, int]) -> dict:
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def setup_store(data_dir: Path, size: int, storage_kind: str):
+    """Заполняет хранилище size отзывами и подменяет им хранилище приложения"""
+    reviews = []
+    for i in range(size):
+        review = make_review(i)
+        review["id"] = new_review_id()
+        reviews.append(review)
+    snapshot_file = data_dir / "reviews.json"
+    with open(snapshot_file, "w", encoding="utf-8") as f:
+        # В снимке новые отзывы сверху
+        json.dump(reviews[::-1], f, ensure_ascii=False)
+
+    storage = JsonLogStorage(snapshot_file, data_dir / "reviews.log", main.DEFAULT_REVIEWS)
+    if storage_kind == "sqlite":
+        storage = SqliteStorage(data_dir / "reviews.db", storage)
+    main.review_store = ReviewStore(storage)
+    main.review_writer = ReviewWriter(main.review_store)
+    main.review_responses = ResponseCache()
+
+    start = time.perf_counter()
+    await main.review_writer.start()
+    return time.perf_counter() - start
+
+
+async def run_scenario(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> dict:
+    """total запросов, не больше concurrency одновременно"""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, statuses)
+
+
+async def get_all(client, i):
+    return await client.get("/api/reviews")
+
+
+async def get_page(client, i):
+    return await client.get("/api/reviews", params={"limit": 20})
+
+
+async def post_review(client, i):
+    return await client.post("/api/reviews", json=make_review(i))
+
+
+async def delete_review(client, i):
+    index = random.randrange(max(len(main.review_store), 1))
+    return await client.delete(f"/api/reviews/{index}", params={"username": main.ADMIN_USERNAME})
+
+
+async def run_mixed(client: httpx.AsyncClient, total: int, concurrency: int, write_share: float) -> dict:
+    """Чтение страниц и добавление отзывов одновременно; задержки считаются отдельно"""
+    writers = max(1, round(concurrency * write_share))
+    readers = max(1, concurrency - writers)
+    write_total = max(1, round(total * write_share))
+    reads, writes = await asyncio.gather(
+        run_scenario(client, get_page, total - write_total, readers),
+        run_scenario(client, post_review, write_total, writers),
+    )
+    return {"read": reads, "write": writes, "readers": readers, "writers": writers}
+
+
+async def bench_size(size: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench_reviews_") as tmp:
+        load_seconds = await setup_store(Path(tmp), size, args.storage)
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                result = {"size": size, "load_ms": round(load_seconds * 1000, 3)}
+                # GET всего списка дорогой на больших размерах, его запросов меньше
+                full_requests = args.requests if size <= 10_000 else max(args.requests // 10, 10)
+                result["get_all"] = await run_scenario(client, get_all, full_requests, args.concurrency)
+                result["get_page"] = await run_scenario(client, get_page, args.requests, args.concurrency)
+                result["post"] = await run_scenario(client, post_review, args.requests, args.concurrency)
+                result["delete"] = await run_scenario(client, delete_review, args.requests, args.concurrency)
+                result["mixed"] = await run_mixed(client, args.requests, args.concurrency, args.write_share)
+        finally:
+            await main.review_writer.stop()
+    return result
+
+
+def print_row(size: int, name: str, stats: dict):
+    print(f"{size:>8} {name:<12} {stats['throughput']:>10.1f} {stats['p50_ms']:>9.3f} {stats['p99_ms']:>9.3f}  {stats['statuses']}")
+
+
+async def run(args) -> dict:
+    results = []
+    print(f"{'size':>8} {'scenario':<12} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}  statuses")
+    for size in args.sizes:
+        result = await bench_size(size, args)
+        results.append(result)
+        for name in ("get_all", "get_page", "post", "delete"):
+            print_row(size, name, result[name])
+        print_row(size, "mixed:read", result["mixed"]["read"])
+        print_row(size, "mixed:write", result["mixed"]["write"])
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": args.storage,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "write_share": args.write_share,
+        "results": results,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API отзывов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-share", type=float, default=0.1, help="доля записи в смешанной нагрузке")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default=main.REVIEWS_STORAGE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
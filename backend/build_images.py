@@ -0,0 +1,159 @@
+"""
+Сборка адаптивных картинок для Mini App: WebP/AVIF нескольких ширин
+
+Запуск (нужен Pillow: pip install Pillow):
+    python build_images.py
+    python build_images.py --widths 320 640 --formats webp --jobs 4
+
+Результат складывается в docs/images/_variants вместе с manifest.json,
+который читает эндпоинт /api/images/... Картинки, у которых не изменился
+хэш исходника, повторно не обрабатываются.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from PIL import Image, features
+
+IMAGES_DIR = Path(__file__).parent.parent / "docs" / "images"
+VARIANTS_DIRNAME = "_variants"
+MANIFEST_NAME = "manifest.json"
+
+SOURCE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+DEFAULT_WIDTHS = [320, 640, 960, 1280]
+DEFAULT_FORMATS = ["avif", "webp"]
+
+# Качество подобрано так, чтобы на телефоне разница с оригиналом не была заметна
+QUALITY = {"webp": 80, "avif": 55}
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_sources(images_dir: Path) -> List[Path]:
+    return sorted(
+        path for path in images_dir.rglob("*")
+        if path.suffix.lower() in SOURCE_EXTENSIONS and VARIANTS_DIRNAME not in path.parts
+    )
+
+
+def process_image(source: Path, rel_path: str, source_hash: str, out_dir: Path,
+                  widths: List[int], formats: List[str]) -> dict:
+    """Делает все варианты одной картинки; выполняется в отдельном процессе"""
+    with Image.open(source) as image:
+        image.load()
+        original_width, original_height = image.size
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        # Ширины больше исходной не нужны, но сама исходная ширина - нужна
+        targets = sorted({w for w in widths if w < original_width} | {min(max(widths), original_width)})
+        variants = []
+        stem = Path(rel_path).with_suffix("")
+        for width in targets:
+            height = round(original_height * width / original_width)
+            resized = image if width == original_width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                variant_rel = f"{stem}-{width}.{fmt}"
+                target = out_dir / variant_rel
+                target.parent.mkdir(parents=True, exist_ok=True)
+                resized.save(target, fmt.upper(), quality=QUALITY[fmt])
+                variants.append({
+                    "width": width,
+                    "format": fmt,
+                    "path": f"{VARIANTS_DIRNAME}/{variant_rel}",
+                    "size": target.stat().st_size,
+                })
+    return {
+        "hash": source_hash,
+        "width": original_width,
+        "height": original_height,
+        "variants": variants,
+    }
+
+
+def load_manifest(path: Path) -> dict:
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def is_up_to_date(entry: dict, source_hash: str, images_dir: Path) -> bool:
+    return (
+        entry.get("hash") == source_hash
+        and all((images_dir / variant["path"]).exists() for variant in entry.get("variants", []))
+    )
+
+
+def build(images_dir: Path, widths: List[int], formats: List[str], jobs: int, force: bool = False) -> dict:
+    out_dir = images_dir / VARIANTS_DIRNAME
+    manifest_path = out_dir / MANIFEST_NAME
+    old_manifest = load_manifest(manifest_path)
+    manifest = {}
+    pending = []
+
+    for source in find_sources(images_dir):
+        rel_path = source.relative_to(images_dir).as_posix()
+        source_hash = file_hash(source)
+        entry = old_manifest.get(rel_path)
+        if not force and entry and is_up_to_date(entry, source_hash, images_dir):
+            manifest[rel_path] = entry
+        else:
+            pending.append((source, rel_path, source_hash))
+
+    print(f"Картинок: {len(manifest) + len(pending)}, к обработке: {len(pending)}")
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(process_image, source, rel_path, source_hash, out_dir, widths, formats): rel_path
+                for source, rel_path, source_hash in pending
+            }
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    manifest[rel_path] = future.result()
+                    print(f"✅ {rel_path}")
+                except Exception as e:
+                    print(f"❌ {rel_path}: {e}")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(manifest.items())), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка WebP/AVIF вариантов картинок Mini App")
+    parser.add_argument("--images-dir", type=Path, default=IMAGES_DIR)
+    parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS, choices=sorted(QUALITY))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="пересобрать всё, не глядя на хэши")
+    args = parser.parse_args()
+
+    formats = args.formats
+    if "avif" in formats and not features.check("avif"):
+        print("⚠️  Pillow собран без AVIF, делаем только WebP")
+        formats = [fmt for fmt in formats if fmt != "avif"]
+    if not formats:
+        sys.exit(1)
+
+    build(args.images_dir, args.widths, formats, args.jobs, args.force)
+
+
+if __name__ == "__main__":
+    main()
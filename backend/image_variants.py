@@ -0,0 +1,50 @@
+"""
+Выбор подходящего варианта картинки (формат и ширина) по заголовку Accept
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import json
+
+# Сначала лучшее сжатие
+FORMAT_PREFERENCE = (("avif", "image/avif"), ("webp", "image/webp"))
+
+
+class ImageVariants:
+    """Манифест, собранный build_images.py"""
+
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = manifest_file
+        self.images: Dict[str, dict] = {}
+
+    def load(self):
+        if not self.manifest_file.exists():
+            self.images = {}
+            return
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.images = json.load(f)
+        except Exception as e:
+            print(f"Ошибка при загрузке манифеста картинок: {e}")
+            self.images = {}
+
+    def pick(self, rel_path: str, accept: str, width: Optional[int] = None) -> Optional[str]:
+        """
+        Путь к варианту (относительно папки images) или None, если отдавать
+        нужно оригинал: вариантов нет или клиент не принимает ни AVIF, ни WebP.
+        Берётся самая узкая картинка не уже width, а без width - самая широкая.
+        """
+        entry = self.images.get(rel_path)
+        if entry is None:
+            return None
+        for fmt, media_type in FORMAT_PREFERENCE:
+            if media_type not in accept:
+                continue
+            variants = sorted((v for v in entry["variants"] if v["format"] == fmt), key=lambda v: v["width"])
+            if not variants:
+                continue
+            if width is not None:
+                for variant in variants:
+                    if variant["width"] >= width:
+                        return variant["path"]
+            return variants[-1]["path"]
+        return None
@@ -1,16 +1,26 @@
 """
 FastAPI бэкенд для веб-сайта
 """
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import List, Optional
+import datetime
+import importlib.util
 import os
-import json
+import secrets
+import sys
+
+from response_cache import ResponseCache
+from review_store import ReviewStore, ReviewWriter, JsonLogStorage, SqliteStorage
+from image_variants import ImageVariants
+from menu_store import MenuStore
+from metrics import REGISTRY, MetricsMiddleware
+from ratelimit import RateLimitMiddleware, RateLimitRule
+from static_assets import StaticAssets, etag_matches
 
 # Загружаем переменные окружения из .env файла
 env_path = Path(__file__).parent.parent / '.env'
@@ -31,8 +41,125 @@ class ReviewDelete(BaseModel):
     index: int
     username: str  # Для проверки прав администратора
 
-# Хранение отзывов (в продакшене лучше использовать БД)
+class MenuIngredients(BaseModel):
+    title: Optional[str] = None
+    items: List[str]
+
+class MenuAlternate(BaseModel):
+    meal: str
+    name: str
+    image: Optional[str] = None
+    ingredients: Optional[List[MenuIngredients]] = None
+
+class MenuMeal(BaseModel):
+    meal: str
+    name: str
+    image: str
+    calories: str = ""
+    description: str = ""
+    note: Optional[str] = None
+    ingredients: List[MenuIngredients] = []
+    alternate: Optional[MenuAlternate] = None
+
+class MenuPrice(BaseModel):
+    old: str
+    new: str
+
+class MenuDay(BaseModel):
+    title: str
+    price: Optional[MenuPrice] = None
+    meals: List[MenuMeal]
+
+# Администратор, которому доступны удаление отзывов и правка меню
+ADMIN_USERNAME = "Nill_Kafri"
+
+# Количество процессов uvicorn; при > 1 процессы согласуют данные через process_sync
+WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+
+def create_shared_state(data_dir: Path, name: str):
+    """Общие для процессов блокировки и номер поколения (только при WEB_CONCURRENCY > 1)"""
+    if WORKERS <= 1:
+        return None
+    from process_sync import SharedState
+    return SharedState(data_dir, name)
+
+# Хранение отзывов: json (файл + журнал) или sqlite
+REVIEWS_STORAGE = os.getenv("REVIEWS_STORAGE", "json")
 REVIEWS_FILE = Path(__file__).parent.parent / "reviews.json"
+# Журнал изменений, который периодически сворачивается в REVIEWS_FILE
+REVIEWS_LOG_FILE = Path(__file__).parent.parent / "reviews.log"
+# База SQLite; при первом запуске в неё импортируется REVIEWS_FILE
+REVIEWS_DB_FILE = Path(__file__).parent.parent / "reviews.db"
+
+# Mini App, который раздаётся по /static/
+STATIC_DIR = Path(os.getenv("STATIC_DIR", Path(__file__).parent.parent / "docs"))
+static_assets = StaticAssets(STATIC_DIR)
+# Варианты картинок из build_images.py
+image_variants = ImageVariants(STATIC_DIR / "images" / "_variants" / "manifest.json")
+
+# Меню по дням (см. menu_store.py)
+MENU_FILE = Path(os.getenv("MENU_FILE", Path(__file__).parent / "menu.json"))
+menu_store = MenuStore(MENU_FILE, shared=create_shared_state(MENU_FILE.parent, "menu"))
+# Готовые ответы API меню
+menu_responses = ResponseCache()
+
+# BOT_MODE=webhook: бот (bot/main.py) работает внутри бэкенда и получает
+# обновления на /telegram/webhook вместо отдельного процесса с polling
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Папка с кодом бота; в образ бэкенда (backend/Dockerfile) она не попадает сама
+BOT_DIR = Path(os.getenv("BOT_DIR", Path(__file__).parent.parent / "bot"))
+
+def load_telegram_bot():
+    """Модуль бота для режима webhook (загружается по пути: у бэкенда свой main.py)"""
+    if BOT_MODE != "webhook":
+        return None
+    if not (BOT_DIR / "main.py").is_file():
+        print(f"BOT_MODE=webhook, но код бота не найден: {BOT_DIR} - бот не запущен")
+        return None
+    if WORKERS > 1:
+        # У каждого процесса были бы свои сессии, очередь чатов и webhook:
+        # Telegram отдаёт обновление любому свободному процессу, и геолокация
+        # попадала бы не туда, где открыта сессия
+        print("BOT_MODE=webhook работает только с WEB_CONCURRENCY=1 - бот не запущен; "
+              "запустите бота отдельным процессом (polling) или бэкенд в одном процессе")
+        return None
+    # Для модулей, которые бот импортирует из своей папки
+    sys.path.append(str(BOT_DIR))
+    spec = importlib.util.spec_from_file_location("fit_bot", BOT_DIR / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not module.BOT_TOKEN:
+        print("BOT_MODE=webhook, но BOT_TOKEN не установлен - бот не запущен")
+        return None
+    return module
+
+telegram_bot = load_telegram_bot()
+telegram_app = telegram_bot.build_application() if telegram_bot else None
+
+# Размер страницы архива меню (дней)
+MENU_ARCHIVE_PAGE = 7
+MAX_MENU_ARCHIVE_PAGE = 31
+
+# Максимальный размер страницы в GET /api/reviews
+MAX_REVIEWS_PAGE = 100
+
+# Ограничение частоты запросов (см. ratelimit.py); лимиты - (жетонов в секунду, запас)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+# Сколько доверенных прокси (Railway, Nginx) стоит перед бэкендом: адрес клиента
+# берётся из X-Forwarded-For на столько позиций справа (0 - заголовку не верим)
+RATE_LIMIT_TRUST_PROXY = int(os.getenv("RATE_LIMIT_TRUST_PROXY", 0))
+# Одновременно выполняющихся запросов; сверх этого - 503
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 256))
+# Любые запросы с одного IP (Mini App при открытии грузит несколько десятков файлов)
+DEFAULT_RATE_LIMIT = (50, 200)
+RATE_LIMIT_RULES = [
+    # Отзыв с одного IP - не чаще раза в 10 секунд, всего - не больше 2 в секунду
+    RateLimitRule("POST", "/api/reviews", per_ip=(0.1, 5), total=(2, 20), max_in_flight=16),
+    RateLimitRule("DELETE", "/api/reviews", per_ip=(1, 30), max_in_flight=16),
+    RateLimitRule("PUT", "/api/menu", per_ip=(1, 30), max_in_flight=4),
+    # Telegram присылает обновления с нескольких адресов, общий лимит по IP для него мал
+    RateLimitRule("POST", "/telegram/webhook", per_ip=(500, 1000)),
+]
 
 # Базовые отзывы
 DEFAULT_REVIEWS = [
@@ -70,27 +197,33 @@ DEFAULT_REVIEWS = [
     }
 ]
 
+def create_review_storage():
+    """Создаёт хранилище отзывов по REVIEWS_STORAGE"""
+    json_storage = JsonLogStorage(REVIEWS_FILE, REVIEWS_LOG_FILE, DEFAULT_REVIEWS)
+    if REVIEWS_STORAGE == "sqlite":
+        return SqliteStorage(REVIEWS_DB_FILE, json_storage)
+    if REVIEWS_STORAGE != "json":
+        print(f"Неизвестный REVIEWS_STORAGE={REVIEWS_STORAGE!r}, используем json")
+    return json_storage
+
+review_store = ReviewStore(create_review_storage())
+# Все изменения отзывов проходят через одного фонового писателя
+review_writer = ReviewWriter(review_store, shared=create_shared_state(REVIEWS_FILE.parent, "reviews"))
+# Готовые (сериализованные и сжатые) ответы API отзывов
+review_responses = ResponseCache()
+
 def load_reviews():
-    """Загружает отзывы из файла или возвращает базовые"""
-    if REVIEWS_FILE.exists():
-        try:
-            with open(REVIEWS_FILE, 'r', encoding='utf-8') as f:
-                reviews = json.load(f)
-                if reviews:
-                    return reviews
-        except Exception as e:
-            print(f"Ошибка при загрузке отзывов: {e}")
-    return DEFAULT_REVIEWS.copy()
-
-def save_reviews(reviews: List[dict]):
-    """Сохраняет отзывы в файл"""
-    try:
-        with open(REVIEWS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(reviews, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"Ошибка при сохранении отзывов: {e}")
-        return False
+    """Возвращает отзывы из памяти (файл читается один раз при старте)"""
+    return review_store.list()
+
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        rules=RATE_LIMIT_RULES,
+        default_per_ip=DEFAULT_RATE_LIMIT,
+        max_in_flight=MAX_IN_FLIGHT,
+        trusted_proxies=RATE_LIMIT_TRUST_PROXY,
+    )
 
 # Настройка CORS (если нужно)
 app.add_middleware(
@@ -101,8 +234,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Статические файлы (если будут)
-# app.mount("/static", StaticFiles(directory="static"), name="static")
+# Метрики подключаются последними, чтобы учитывать и отказы по лимитам
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+async def load_review_store():
+    """Однократная загрузка отзывов при старте"""
+    await review_writer.start()
+
+@app.on_event("startup")
+async def load_menu():
+    """Загрузка меню при старте"""
+    menu_store.load()
+
+@app.on_event("startup")
+async def build_static_manifest():
+    """Хэши файлов Mini App для URL с отпечатками"""
+    if STATIC_DIR.is_dir():
+        static_assets.build_manifest()
+        image_variants.load()
+
+@app.on_event("startup")
+async def start_telegram_bot():
+    """Запуск бота в режиме webhook"""
+    if telegram_app is not None:
+        await telegram_bot.start_webhook(telegram_app)
+
+@app.on_event("shutdown")
+async def stop_review_writer():
+    """Дописывает оставшиеся в очереди изменения"""
+    await review_writer.stop()
+
+@app.on_event("shutdown")
+async def stop_telegram_bot():
+    if telegram_app is not None:
+        await telegram_bot.stop_webhook(telegram_app)
+
+# Mini App (docs/) со своими правилами кэширования, см. static_assets.py
+if STATIC_DIR.is_dir():
+    app.mount("/static", static_assets, name="static")
+else:
+    print(f"Папка со статикой не найдена: {STATIC_DIR}")
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -192,49 +364,221 @@ async def info():
         "status": "running"
     }
 
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Обновления от Telegram (BOT_MODE=webhook); обрабатываются ботом в фоне"""
+    if telegram_app is None:
+        raise HTTPException(status_code=404, detail="Webhook не включен")
+    secret = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not secrets.compare_digest(secret, telegram_bot.WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Неверный секрет")
+    try:
+        update = telegram_bot.Update.de_json(await request.json(), telegram_app.bot)
+    except Exception as e:
+        print(f"Некорректное обновление от Telegram: {e}")
+        raise HTTPException(status_code=400, detail="Некорректное обновление")
+    # Ответ сразу, не дожидаясь обработчиков: иначе Telegram придержит следующие обновления
+    await telegram_app.update_queue.put(update)
+    return Response(status_code=200)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/images/{image_path:path}")
+async def get_image(request: Request, image_path: str, w: Optional[int] = Query(None, ge=1, le=4096)):
+    """Картинка Mini App в лучшем формате, который принимает клиент, и нужной ширины"""
+    variant = image_variants.pick(image_path, request.headers.get("accept", ""), w)
+    asset, _ = static_assets.lookup(f"images/{variant or image_path}")
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Картинка не найдена")
+    response = static_assets.file_response(request, asset)
+    # Выбор варианта зависит от Accept и может измениться после пересборки
+    response.headers["Vary"] = "Accept"
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return response
+
 @app.get("/api/reviews")
-async def get_reviews():
-    """Получить все отзывы"""
-    reviews = load_reviews()
-    return {"reviews": reviews}
+async def get_reviews(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_REVIEWS_PAGE),
+    cursor: Optional[str] = None,
+    rating: Optional[int] = Query(None, ge=1, le=5),
+    city: Optional[str] = None,
+    handle: Optional[str] = None,
+):
+    """Получить отзывы (новые сверху) с фильтрами и постраничной выдачей"""
+    await review_writer.refresh()
+    # Версия хранилища однозначно определяет ответ на один и тот же URL,
+    # поэтому неизменившийся список подтверждается без загрузки данных
+    headers = {"ETag": review_store.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, review_store.etag):
+        return Response(status_code=304, headers=headers)
+    
+    def build():
+        if limit is None and cursor is None and rating is None and city is None and handle is None:
+            return {"reviews": load_reviews(), "next_cursor": None}
+        reviews, next_cursor = review_store.page(limit, cursor, rating=rating, city=city, handle=handle)
+        return {"reviews": reviews, "next_cursor": next_cursor}
+    
+    # Сериализуется и сжимается один раз на версию, дальше отдаются готовые байты
+    params = {"limit": limit, "cursor": cursor, "rating": rating, "city": city, "handle": handle}
+    return review_responses.respond(request, review_store.etag, build, headers, params)
+
+@app.get("/api/reviews/stats")
+async def get_review_stats(request: Request):
+    """Средняя оценка, распределение оценок и число отзывов по городам"""
+    await review_writer.refresh()
+    headers = {"ETag": review_store.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, review_store.etag):
+        return Response(status_code=304, headers=headers)
+    return review_responses.respond(request, review_store.etag, review_store.stats, headers)
+
+@app.get("/api/reviews/search")
+async def search_reviews(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=MAX_REVIEWS_PAGE),
+):
+    """Поиск отзывов по тексту, имени и городу"""
+    await review_writer.refresh()
+    headers = {"ETag": review_store.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, review_store.etag):
+        return Response(status_code=304, headers=headers)
+    return review_responses.respond(
+        request, review_store.etag, lambda: {"reviews": review_store.search(q, limit)}, headers,
+        {"q": q, "limit": limit}
+    )
 
 @app.post("/api/reviews")
 async def add_review(review: Review):
     """Добавить новый отзыв"""
-    reviews = load_reviews()
-    review_dict = review.dict()
-    reviews.insert(0, review_dict)  # Добавляем в начало
-    if save_reviews(reviews):
-        return {"status": "success", "message": "Отзыв добавлен"}
-    else:
+    try:
+        await review_writer.add(review.dict())
+    except Exception as e:
+        print(f"Ошибка при сохранении отзывов: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при сохранении отзыва")
+    return {"status": "success", "message": "Отзыв добавлен"}
 
 @app.delete("/api/reviews/{review_index}")
 async def delete_review(review_index: int, username: Optional[str] = None):
     """Удалить отзыв по индексу (только для администратора)"""
     # Проверка прав администратора
-    if username != "Nill_Kafri":
+    if username != ADMIN_USERNAME:
         raise HTTPException(status_code=403, detail="Недостаточно прав для удаления отзыва")
     
-    reviews = load_reviews()
-    
-    if review_index < 0 or review_index >= len(reviews):
+    try:
+        deleted_review = await review_writer.delete(review_index)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Отзыв не найден")
+    except Exception as e:
+        print(f"Ошибка при сохранении отзывов: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при сохранении изменений")
     
-    deleted_review = reviews.pop(review_index)
+    return {
+        "status": "success",
+        "message": "Отзыв удален",
+        "deleted_review": deleted_review
+    }
+
+@app.delete("/api/reviews/by-id/{review_id}")
+async def delete_review_by_id(review_id: str, username: Optional[str] = None):
+    """Удалить отзыв по постоянному id (только для администратора)"""
+    if username != ADMIN_USERNAME:
+        raise HTTPException(status_code=403, detail="Недостаточно прав для удаления отзыва")
     
-    if save_reviews(reviews):
-        return {
-            "status": "success",
-            "message": "Отзыв удален",
-            "deleted_review": deleted_review
-        }
-    else:
+    try:
+        deleted_review = await review_writer.delete_by_id(review_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Отзыв не найден")
+    except Exception as e:
+        print(f"Ошибка при сохранении отзывов: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при сохранении изменений")
+    
+    return {
+        "status": "success",
+        "message": "Отзыв удален",
+        "deleted_review": deleted_review
+    }
+
+
+@app.get("/api/menu/current")
+async def get_current_menu(request: Request):
+    """Текущее меню (дни, которые показывает Mini App)"""
+    await menu_store.refresh()
+    headers = {"ETag": menu_store.current_etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, menu_store.current_etag):
+        return Response(status_code=304, headers=headers)
+    return menu_responses.respond(request, menu_store.current_etag, menu_store.current, headers)
+
+@app.get("/api/menu/archive")
+async def get_menu_archive(
+    request: Request,
+    before: Optional[datetime.date] = None,
+    limit: int = Query(MENU_ARCHIVE_PAGE, ge=1, le=MAX_MENU_ARCHIVE_PAGE),
+):
+    """
+    Архив меню страницами от новых дней к старым: только названия блюд и
+    миниатюры. Следующая страница - ?before=<next_before>, полное меню
+    дня - /api/menu/day/{date}.
+    """
+    await menu_store.refresh()
+    before = before.isoformat() if before else None
+    headers = {"ETag": menu_store.archive_etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, menu_store.archive_etag):
+        return Response(status_code=304, headers=headers)
+    return menu_responses.respond(
+        request, menu_store.archive_etag, lambda: menu_store.archive(before, limit), headers,
+        {"before": before, "limit": limit}
+    )
+
+@app.get("/api/menu/day/{date}")
+async def get_menu_day(request: Request, date: datetime.date):
+    """Меню одного дня"""
+    await menu_store.refresh()
+    date = date.isoformat()
+    etag = menu_store.day_etag(date)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Меню на этот день не найдено")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return menu_responses.respond(request, etag, lambda: menu_store.day(date), headers)
+
+@app.put("/api/menu/day/{date}")
+async def put_menu_day(date: datetime.date, day: MenuDay, username: Optional[str] = None):
+    """Добавить или заменить меню дня (только для администратора)"""
+    if username != ADMIN_USERNAME:
+        raise HTTPException(status_code=403, detail="Недостаточно прав для изменения меню")
+    try:
+        await menu_store.update_day({"date": date.isoformat(), **day.dict(exclude_none=True)})
+    except Exception as e:
+        print(f"Ошибка при сохранении меню: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при сохранении меню")
+    return {"status": "success", "message": "Меню сохранено"}
+
+@app.put("/api/menu/current")
+async def put_current_menu(dates: List[datetime.date], username: Optional[str] = None):
+    """Задать дни текущего меню (только для администратора)"""
+    if username != ADMIN_USERNAME:
+        raise HTTPException(status_code=403, detail="Недостаточно прав для изменения меню")
+    try:
+        await menu_store.set_current([date.isoformat() for date in dates])
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Нет меню на даты: {e.args[0]}")
+    except Exception as e:
+        print(f"Ошибка при сохранении меню: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при сохранении меню")
+    return {"status": "success", "message": "Текущее меню обновлено"}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if WORKERS > 1:
+        # Несколько процессов запускаются только по строке импорта
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
 
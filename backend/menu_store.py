@@ -0,0 +1,218 @@
+"""
+Меню по дням: блюда, состав и цены (раньше было зашито в docs/index.html)
+"""
+from bisect import bisect_left, insort
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import os
+
+# Ширина миниатюр в кратком описании дня для архива
+THUMBNAIL_WIDTH = 320
+
+
+def content_etag(data) -> str:
+    body = json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+
+def thumbnail_url(image: str) -> str:
+    """Уменьшенная картинка блюда через /api/images"""
+    return f"/api/images/{image.removeprefix('images/')}?w={THUMBNAIL_WIDTH}"
+
+
+def day_summary(day: dict) -> dict:
+    """Краткое описание дня для архива: названия блюд и миниатюры"""
+    return {
+        "date": day["date"],
+        "title": day.get("title", ""),
+        "dishes": [
+            {"meal": meal["meal"], "name": meal["name"], "thumbnail": thumbnail_url(meal["image"])}
+            for meal in day.get("meals", [])
+        ],
+    }
+
+
+class MenuStore:
+    """
+    Дни меню из menu.json, ключ - дата в формате YYYY-MM-DD.
+
+    Для каждого дня заранее считается ETag по содержимому, поэтому ответ
+    на повторный запрос того же дня - 304 без сериализации. Список
+    "текущих" дней - то, что Mini App показывает в разделе меню.
+
+    Если передан shared (process_sync.SharedState), файл делят несколько
+    процессов, как и отзывы: правка идёт под межпроцессной блокировкой
+    поверх актуального файла и увеличивает номер поколения, а refresh()
+    перечитывает меню, когда номер изменил другой процесс.
+    """
+
+    def __init__(self, menu_file: Path, shared=None):
+        self.menu_file = menu_file
+        self.shared = shared
+        self._seen_generation: Optional[int] = None
+        self._days: Dict[str, dict] = {}
+        self._etags: Dict[str, str] = {}
+        self._summaries: Dict[str, dict] = {}
+        # Даты по возрастанию
+        self._dates: List[str] = []
+        self._current: List[str] = []
+        self.current_etag = ""
+        self.archive_etag = ""
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    def load(self):
+        """Читает menu.json (при общем файле - под разделяемой блокировкой)"""
+        generation, data = self._read_shared()
+        self._apply(data)
+        self._seen_generation = generation
+
+    def _read(self) -> dict:
+        data = {"current": [], "days": []}
+        if self.menu_file.exists():
+            try:
+                with open(self.menu_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Ошибка при загрузке меню: {e}")
+        return data
+
+    def _read_shared(self):
+        if self.shared is None:
+            return None, self._read()
+        self.shared.read_lock.acquire(shared=True)
+        try:
+            return self.shared.generation.value, self._read()
+        finally:
+            self.shared.read_lock.release()
+
+    def _apply(self, data: dict):
+        self._days = {}
+        self._etags = {}
+        self._summaries = {}
+        self._dates = []
+        for day in data.get("days", []):
+            self._put(day)
+        self._current = [date for date in data.get("current", []) if date in self._days]
+        self._update_current_etag()
+        self._update_archive_etag()
+
+    def _put(self, day: dict):
+        date = day["date"]
+        if date not in self._days:
+            insort(self._dates, date)
+        self._days[date] = day
+        self._etags[date] = content_etag(day)
+        self._summaries[date] = day_summary(day)
+
+    def _update_current_etag(self):
+        self.current_etag = content_etag([self._etags[date] for date in self._current])
+
+    def _update_archive_etag(self):
+        self.archive_etag = content_etag([self._etags[date] for date in self._dates])
+
+    def day(self, date: str) -> Optional[dict]:
+        return self._days.get(date)
+
+    def day_etag(self, date: str) -> Optional[str]:
+        return self._etags.get(date)
+
+    def current(self) -> dict:
+        return {"days": [self._days[date] for date in self._current]}
+
+    def archive(self, before: Optional[str] = None, limit: int = 7) -> dict:
+        """
+        Страница архива: краткие описания дней до before (не включая), от новых
+        к старым. Позиция ищется бинарным поиском по отсортированным датам,
+        так что страница стоит одинаково при любой длине истории.
+        """
+        end = bisect_left(self._dates, before) if before else len(self._dates)
+        start = max(end - limit, 0)
+        dates = self._dates[start:end]
+        return {
+            "days": [self._summaries[date] for date in reversed(dates)],
+            "next_before": dates[0] if start > 0 else None,
+        }
+
+    def _serialize(self) -> str:
+        data = {"current": self._current, "days": [self._days[date] for date in self._dates]}
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def _write(self, text: str):
+        tmp_file = self.menu_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.menu_file)
+
+    def is_stale(self) -> bool:
+        """Изменил ли меню другой процесс; это чтение из отображённой памяти"""
+        return self.shared is not None and self.shared.generation.value != self._seen_generation
+
+    def _lock(self) -> asyncio.Lock:
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def refresh(self):
+        """Подхватывает правки меню, сделанные другими процессами"""
+        if not self.is_stale():
+            return
+        async with self._lock():
+            if self.is_stale():
+                generation, data = await asyncio.get_running_loop().run_in_executor(None, self._read_shared)
+                self._apply(data)
+                self._seen_generation = generation
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Единоличная правка: актуальное меню в памяти, запись без чужих правок"""
+        async with self._lock():
+            if self.shared is None:
+                yield
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.shared.write_lock.acquire)
+            try:
+                if self.is_stale():
+                    # Правка ложится поверх версии, которую записал другой процесс
+                    generation = self.shared.generation.value
+                    self._apply(await loop.run_in_executor(None, self._read))
+                    self._seen_generation = generation
+                yield
+            finally:
+                self.shared.write_lock.release()
+
+    async def _save(self):
+        """Вызывается внутри _exclusive(): снимок на event loop, запись файла - в отдельном потоке"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, self._serialize())
+        except Exception:
+            # Память уже изменена, а файл нет - возвращаемся к файлу
+            self._apply(await asyncio.get_running_loop().run_in_executor(None, self._read))
+            raise
+        if self.shared is not None:
+            self._seen_generation = self.shared.generation.bump()
+
+    async def update_day(self, day: dict):
+        """Добавляет или заменяет день и сохраняет меню"""
+        async with self._exclusive():
+            self._put(day)
+            if day["date"] in self._current:
+                self._update_current_etag()
+            self._update_archive_etag()
+            await self._save()
+
+    async def set_current(self, dates: List[str]):
+        """Задаёт дни, которые показываются как текущее меню"""
+        async with self._exclusive():
+            missing = [date for date in dates if date not in self._days]
+            if missing:
+                raise KeyError(", ".join(missing))
+            self._current = sorted(set(dates))
+            self._update_current_etag()
+            await self._save()
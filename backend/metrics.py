@@ -0,0 +1,198 @@
+"""
+Метрики в текстовом формате Prometheus: запросы по маршрутам, время работы с хранилищем и сериализации
+"""
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+import threading
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин гистограмм, сек
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INF_LABEL = 'le="+Inf"'
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Общая часть метрик: значения по набору меток. Обновляются из потоков
+    (запись на диск идёт в run_in_executor), поэтому под блокировкой.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values: str):
+        """Замеряет время блока, в том числе если он завершился исключением"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        lines = self.header()
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, INF_LABEL)} {state[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {state[-2]!r}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Количество HTTP-запросов", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Запросы, которые выполняются сейчас"))
+REVIEWS_STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "reviews_storage_seconds", "Время операций с хранилищем отзывов на диске", ("operation",)))
+RESPONSE_BUILD_SECONDS = REGISTRY.register(Histogram(
+    "response_build_seconds", "Время подготовки JSON-ответа: сериализация и сжатие", ("stage",)))
+
+
+def route_label(scope: Scope, root_path: str) -> str:
+    """
+    Шаблон маршрута (/api/reviews/by-id/{review_id}), а не сам путь, чтобы
+    число рядов метрик не росло с каждым новым id. Роутер дописывает
+    найденный маршрут в scope; для смонтированных приложений - путь монтирования.
+    """
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path"):
+        return route.path
+    mounted = scope.get("root_path", "")
+    if mounted != root_path and mounted.startswith(root_path):
+        return mounted[len(root_path):] + "/*"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI-мидлварь: количество и длительность запросов по методу, маршруту и статусу"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            labels = (scope["method"], route_label(scope, root_path), str(status))
+            HTTP_LATENCY.observe(time.perf_counter() - start, *labels)
+            HTTP_REQUESTS.inc(*labels)
@@ -0,0 +1,72 @@
+"""
+Согласование нескольких процессов uvicorn (--workers N) на одной машине
+"""
+from pathlib import Path
+import fcntl
+import mmap
+import os
+import struct
+
+# Раскладка файла поколения: 8 байт эпохи + 8 байт номера поколения
+GENERATION_FORMAT = "<QQ"
+GENERATION_SIZE = struct.calcsize(GENERATION_FORMAT)
+
+
+class FileLock:
+    """Межпроцессная блокировка на flock: общая для чтения, эксклюзивная для записи"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Каждая блокировка открывает свой дескриптор: flock на разных
+        # дескрипторах конфликтует даже внутри одного процесса
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self, shared: bool = False):
+        fcntl.flock(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SharedGeneration:
+    """
+    Номер поколения данных, общий для всех процессов.
+
+    Файл отображён в память, поэтому проверка "не изменилось ли что-то
+    у соседей" - это чтение 8 байт без системных вызовов. Увеличивать
+    номер можно только под эксклюзивной FileLock.
+    """
+
+    def __init__(self, path: Path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < GENERATION_SIZE:
+                os.ftruncate(fd, GENERATION_SIZE)
+                os.pwrite(fd, struct.pack(GENERATION_FORMAT, int.from_bytes(os.urandom(8), "little"), 0), 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, GENERATION_SIZE)
+        finally:
+            os.close(fd)
+
+    @property
+    def epoch(self) -> str:
+        return f"{struct.unpack_from('<Q', self._map, 0)[0]:016x}"
+
+    @property
+    def value(self) -> int:
+        return struct.unpack_from("<Q", self._map, 8)[0]
+
+    def bump(self) -> int:
+        value = self.value + 1
+        struct.pack_into("<Q", self._map, 8, value)
+        return value
+
+
+class SharedState:
+    """Блокировки и номер поколения для хранилища отзывов, разделяемого процессами"""
+
+    def __init__(self, data_dir: Path, name: str):
+        self.write_lock = FileLock(data_dir / f"{name}.lock")
+        self.read_lock = FileLock(data_dir / f"{name}.lock")
+        self.generation = SharedGeneration(data_dir / f"{name}.gen")
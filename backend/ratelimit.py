@@ -0,0 +1,195 @@
+"""
+Ограничение частоты запросов и сброс нагрузки: token bucket по IP и по маршруту, лимит одновременных запросов
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import time
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Корзина, которая простояла столько секунд, уже полная - её можно забыть
+BUCKET_TTL = 600
+# Не больше стольких корзин в памяти (старые вытесняются первыми)
+MAX_BUCKETS = 100_000
+
+
+class TokenBucket:
+    """rate жетонов в секунду, не больше burst про запас"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 - жетон взят, иначе через сколько секунд он появится"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class BucketTable:
+    """
+    Корзины по ключу в порядке последнего обращения. Простоявшие дольше ttl
+    удаляются с начала списка, поэтому чистка не перебирает всю таблицу.
+    """
+
+    def __init__(self, ttl: float = BUCKET_TTL, max_size: int = MAX_BUCKETS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+
+    def take(self, key: tuple, rate: float, burst: float, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take(now)
+        self._expire(now)
+        return wait
+
+    def _expire(self, now: float):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < self.ttl and len(self._buckets) <= self.max_size:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimitRule:
+    """
+    Лимиты для запросов с данным методом и началом пути:
+    per_ip - жетонов в секунду на один IP, total - на всех вместе,
+    max_in_flight - сколько таких запросов может выполняться одновременно.
+    """
+
+    def __init__(self, method: str, path_prefix: str, per_ip: Optional[Tuple[float, float]] = None,
+                 total: Optional[Tuple[float, float]] = None, max_in_flight: Optional[int] = None):
+        self.method = method
+        self.path_prefix = path_prefix
+        self.per_ip = per_ip
+        self.total = total
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path_prefix}"
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and path.startswith(self.path_prefix)
+
+
+class RateLimitMiddleware:
+    """
+    ASGI-мидлварь. Каждый запрос берёт жетон из корзины своего IP (по лимиту
+    первого подходящего правила, а если его нет - default_per_ip) и из общей
+    корзины правила. Нет жетона - 429 с Retry-After.
+    Если одновременно выполняется больше max_in_flight запросов (всего или по
+    правилу) - 503 с Retry-After: новые запросы отбрасываются сразу, а не
+    копятся в очереди. У записи свой маленький лимит, поэтому поток POST не
+    занимает места, нужные чтению.
+    """
+
+    def __init__(self, app: ASGIApp, rules: List[RateLimitRule],
+                 default_per_ip: Optional[Tuple[float, float]] = None,
+                 max_in_flight: Optional[int] = None, trusted_proxies: int = 0):
+        self.app = app
+        self.rules = rules
+        self.default_per_ip = default_per_ip
+        self.max_in_flight = max_in_flight
+        self.trusted_proxies = trusted_proxies
+        self.in_flight = 0
+        self.buckets = BucketTable()
+
+    def client_ip(self, scope: Scope) -> str:
+        """
+        Адрес клиента. За trusted_proxies прокси он берётся из X-Forwarded-For,
+        но справа: левые значения присылает сам клиент и может подделать,
+        а каждый прокси дописывает в конец адрес, от которого получил запрос.
+        """
+        if self.trusted_proxies:
+            headers = scope.get("headers") or []
+            forwarded = [
+                address.strip()
+                for name, value in headers if name == b"x-forwarded-for"
+                for address in value.decode("latin-1").split(",") if address.strip()
+            ]
+            if forwarded:
+                return forwarded[-min(self.trusted_proxies, len(forwarded))]
+            real_ip = dict(headers).get(b"x-real-ip")
+            if real_ip:
+                return real_ip.decode("latin-1").strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def match(self, method: str, path: str) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return None
+
+    def check(self, ip: str, rule: Optional[RateLimitRule], now: float) -> float:
+        """Сколько секунд ждать до следующего разрешённого запроса (0 - можно сейчас)"""
+        wait = 0.0
+        if rule is not None and rule.per_ip:
+            # Лимит правила заменяет общий лимит по IP
+            wait = self.buckets.take((rule.name, ip), *rule.per_ip, now)
+        elif self.default_per_ip:
+            wait = self.buckets.take(("ip", ip), *self.default_per_ip, now)
+        if wait > 0:
+            # Отказ по IP не тратит общий лимит - иначе один спамер исчерпал бы его за всех
+            return wait
+        if rule is not None and rule.total:
+            wait = self.buckets.take((rule.name, None), *rule.total, now)
+        return wait
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rule = self.match(scope["method"], scope["path"])
+        if (self.max_in_flight and self.in_flight >= self.max_in_flight) or (
+            rule is not None and rule.max_in_flight and rule.in_flight >= rule.max_in_flight
+        ):
+            await reject(send, 503, 1, "Сервер перегружен, попробуйте позже")
+            return
+
+        wait = self.check(self.client_ip(scope), rule, time.monotonic())
+        if wait > 0:
+            await reject(send, 429, wait, "Слишком много запросов, попробуйте позже")
+            return
+
+        self.in_flight += 1
+        if rule is not None:
+            rule.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            if rule is not None:
+                rule.in_flight -= 1
+
+
+async def reject(send: Send, status: int, retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    headers: Dict[bytes, bytes] = {
+        b"content-type": b"application/json",
+        b"content-length": str(len(body)).encode(),
+        b"retry-after": str(max(1, math.ceil(retry_after))).encode(),
+    }
+    await send({"type": "http.response.start", "status": status, "headers": list(headers.items())})
+    await send({"type": "http.response.body", "body": body})
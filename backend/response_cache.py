@@ -0,0 +1,114 @@
+"""
+Кэш готовых JSON-ответов: сериализация и сжатие один раз на версию данных
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import gzip
+import json
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from metrics import RESPONSE_BUILD_SECONDS
+
+try:
+    import orjson
+except ImportError:  # без orjson работает и стандартный json, просто медленнее
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # без brotli остаётся gzip
+    brotli = None
+
+# Ответы меньше этого размера не сжимаются - выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 1024
+
+# Сколько разных ответов (URL с параметрами) держать в кэше
+CACHE_SIZE = 256
+
+
+def dump_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def accepted_encodings(request: Request) -> Dict[str, float]:
+    """Разбирает Accept-Encoding в словарь {кодировка: q}"""
+    encodings = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
+class CachedBody:
+    """Один ответ в исходном виде и в сжатых вариантах"""
+
+    def __init__(self, body: bytes):
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            with RESPONSE_BUILD_SECONDS.time("compress"):
+                self.variants["gzip"] = gzip.compress(body, compresslevel=6)
+                if brotli is not None:
+                    self.variants["br"] = brotli.compress(body, quality=5)
+
+    def choose(self, request: Request) -> str:
+        """Лучшая кодировка из тех, что есть и принимает клиент"""
+        accepted = accepted_encodings(request)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, 0) > 0:
+                return encoding
+        return "identity"
+
+
+class ResponseCache:
+    """
+    Готовые ответы по ключу запроса, действительные для одной версии данных.
+    Когда версия меняется (другой ETag), ответ строится и сжимается заново.
+
+    Ключ - путь и проверенные параметры обработчика, а не строка запроса:
+    иначе каждый лишний параметр (?x=1, ?x=2, ...) строил бы и сжимал
+    полный ответ заново и вытеснял бы из кэша нужные записи.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get_body(self, key: tuple, version: str, build: Callable[[], object]) -> CachedBody:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            return entry[1]
+        with RESPONSE_BUILD_SECONDS.time("encode"):
+            data = dump_json(build())
+        body = CachedBody(data)
+        self._entries[key] = (version, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return body
+
+    def respond(self, request: Request, version: str, build: Callable[[], object],
+                headers: Optional[dict] = None, params: Optional[dict] = None) -> Response:
+        """JSON-ответ из кэша в лучшей кодировке для клиента; params - то, от чего зависит ответ"""
+        key = (request.url.path, tuple(sorted(
+            (name, value) for name, value in (params or {}).items() if value is not None
+        )))
+        body = self.get_body(key, version, build)
+        encoding = body.choose(request)
+        headers = dict(headers or {}, Vary="Accept-Encoding")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body.variants[encoding], media_type="application/json", headers=headers)
@@ -0,0 +1,103 @@
+"""
+Полнотекстовый поиск по отзывам: обратный индекс с простой нормализацией русского текста
+"""
+from bisect import bisect_left, insort
+from typing import Dict, List, Set
+import re
+
+# Поля отзыва, по которым ищем
+SEARCH_FIELDS = ("text", "name", "city")
+
+WORD_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Окончания, которые отрезаются от русских слов (сначала длинные).
+# Это не полноценный стеммер, а грубое приведение "блюда/блюдо/блюдом" к одной основе
+SUFFIXES = sorted([
+    "иями", "ями", "ами", "ией", "иях", "ях", "ах", "ов", "ев", "ей", "ий", "ый", "ой",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ым", "им", "ом", "ем", "ам", "ям", "ую", "юю",
+    "ого", "его", "ому", "ему", "ыми", "ими", "ешь", "ишь", "ете", "ите", "ает", "яет",
+    "ала", "ило", "ила", "ли", "ла", "ло", "ть", "ти", "ся", "сь",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+# Основа короче этого не обрезается
+MIN_STEM = 3
+
+
+def normalize(word: str) -> str:
+    """Нижний регистр, ё -> е и отрезание окончания"""
+    word = word.lower().replace("ё", "е")
+    if CYRILLIC_RE.search(word):
+        for suffix in SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+                return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> Set[str]:
+    return {normalize(word) for word in WORD_RE.findall(text)}
+
+
+class ReviewSearchIndex:
+    """
+    Обратный индекс: нормализованное слово -> id отзывов.
+
+    Строится один раз при загрузке и обновляется при каждом добавлении
+    и удалении. Последнее слово запроса ищется по префиксу, чтобы
+    поиск работал по мере набора текста.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        # Отсортированный словарь для поиска по префиксу
+        self._vocabulary: List[str] = []
+
+    def _tokens(self, review: dict) -> Set[str]:
+        tokens = set()
+        for field in SEARCH_FIELDS:
+            tokens |= tokenize(str(review.get(field, "")))
+        return tokens
+
+    def add(self, review: dict):
+        for token in self._tokens(review):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._vocabulary, token)
+            postings.add(review["id"])
+
+    def remove(self, review: dict):
+        for token in self._tokens(review):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(review["id"])
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _prefix_matches(self, prefix: str) -> Set[str]:
+        matches = set()
+        i = bisect_left(self._vocabulary, prefix)
+        while i < len(self._vocabulary) and self._vocabulary[i].startswith(prefix):
+            matches |= self._postings[self._vocabulary[i]]
+            i += 1
+        return matches
+
+    def search(self, query: str) -> List[str]:
+        """id отзывов, содержащих все слова запроса (новые сверху)"""
+        words = WORD_RE.findall(query)
+        if not words:
+            return []
+        term_sets = [self._postings.get(normalize(word), set()) for word in words[:-1]]
+        # Незаконченное последнее слово: префикс и по исходной форме, и по основе
+        last = words[-1].lower().replace("ё", "е")
+        term_sets.append(self._prefix_matches(last) | self._prefix_matches(normalize(last)))
+        term_sets.sort(key=len)
+        result = set(term_sets[0])
+        for postings in term_sets[1:]:
+            result &= postings
+            if not result:
+                break
+        return sorted(result, reverse=True)
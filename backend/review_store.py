@@ -0,0 +1,799 @@
+"""
+Хранилище отзывов: данные в памяти + подключаемое хранилище на диске
+"""
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+
+from metrics import REVIEWS_STORAGE_SECONDS
+from review_search import ReviewSearchIndex
+
+# После стольких записей в журнале он сворачивается в снимок
+COMPACT_THRESHOLD = int(os.getenv("REVIEWS_COMPACT_THRESHOLD", 500))
+
+# Как часто простаивающий писатель убирает надгробия удалённых отзывов, сек
+COMPACT_INTERVAL = float(os.getenv("REVIEWS_COMPACT_INTERVAL", 60))
+
+# Максимум операций, фиксируемых одной записью на диск
+WRITE_BATCH_SIZE = int(os.getenv("REVIEWS_WRITE_BATCH", 256))
+
+# Количество соединений с SQLite в пуле
+DB_POOL_SIZE = int(os.getenv("REVIEWS_DB_POOL_SIZE", 4))
+
+
+# Алфавит Crockford base32, как в ULID
+ID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 26
+
+
+class ReviewIdGenerator:
+    """
+    Идентификаторы в духе ULID: 48 бит времени в мс + 80 бит случайности.
+    Строки одинаковой длины, поэтому сортируются в порядке создания;
+    в пределах одной миллисекунды случайная часть просто увеличивается.
+    """
+
+    def __init__(self):
+        self._last_time = 0
+        self._last_random = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now > self._last_time:
+                self._last_time, self._last_random = now, secrets.randbits(80)
+            else:
+                self._last_random += 1
+                if self._last_random >= 1 << 80:
+                    self._last_time, self._last_random = self._last_time + 1, 0
+            return encode_id((self._last_time << 80) | self._last_random)
+
+    def observe(self, review_id: str):
+        """Гарантирует, что следующие идентификаторы будут больше review_id"""
+        value = decode_id(review_id)
+        with self._lock:
+            if value >> 80 > self._last_time or (
+                    value >> 80 == self._last_time and value & ((1 << 80) - 1) > self._last_random):
+                self._last_time, self._last_random = value >> 80, value & ((1 << 80) - 1)
+
+
+def encode_id(value: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(ID_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def decode_id(review_id: str) -> int:
+    value = 0
+    for char in review_id:
+        value = (value << 5) | ID_ALPHABET.index(char)
+    return value
+
+
+new_review_id = ReviewIdGenerator()
+
+
+def ensure_ids(reviews: List[dict]) -> bool:
+    """Выдаёт идентификаторы отзывам без них; True, если такие нашлись"""
+    assigned = False
+    for review in reviews:
+        if review.get("id"):
+            new_review_id.observe(review["id"])
+    for review in reviews:
+        if not review.get("id"):
+            review["id"] = new_review_id()
+            assigned = True
+    return assigned
+
+
+class JsonLogStorage:
+    """
+    Снимок reviews.json + журнал изменений reviews.log.
+
+    Каждое изменение дописывается одной строкой в журнал, поэтому запись
+    стоит O(1). Время от времени журнал сворачивается в снимок.
+    """
+
+    def __init__(self, snapshot_file: Path, log_file: Path, default_reviews: List[dict]):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+        self.default_reviews = default_reviews
+        self._log_entries = 0
+        self._dirty = False
+
+    def load(self) -> List[dict]:
+        """Читает снимок и проигрывает поверх него журнал (старые отзывы в начале)"""
+        snapshot = list(reversed(self._read_snapshot()))
+        # Отзывы из старых версий файла получают идентификаторы здесь;
+        # чтобы они не менялись между перезапусками, нужен новый снимок
+        self._dirty = ensure_ids(snapshot)
+        reviews = {review["id"]: review for review in snapshot}
+        self._log_entries = 0
+        for record in self._read_log():
+            if record["op"] == "add":
+                self._dirty |= ensure_ids([record["review"]])
+                reviews[record["review"]["id"]] = record["review"]
+            elif record["op"] == "delete" and "id" in record:
+                reviews.pop(record["id"], None)
+            elif record["op"] == "delete":
+                # Записи старого формата: удаление по позиции
+                del reviews[next(islice(reviews, record["position"], None))]
+            self._log_entries += 1
+        return list(reviews.values())
+
+    def _read_snapshot(self) -> List[dict]:
+        if self.snapshot_file.exists():
+            try:
+                with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                    reviews = json.load(f)
+                    if reviews:
+                        return reviews
+            except Exception as e:
+                print(f"Ошибка при загрузке отзывов: {e}")
+        return [dict(review) for review in self.default_reviews]
+
+    def _read_log(self):
+        """
+        Записи журнала по порядку. Хвост после последней целой записи (строка,
+        оборванная падением процесса) отрезается: иначе следующая запись
+        дописалась бы в ту же строку и потерялась бы при перезапуске.
+        """
+        if not self.log_file.exists():
+            return
+        position = end = 0
+        with open(self.log_file, 'rb') as f:
+            for line in f:
+                position += len(line)
+                if not line.endswith(b"\n"):
+                    # Запись не успела дописаться - её и не подтверждали
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Пропущена повреждённая запись журнала: {line[:80]!r}")
+                    continue
+                end = position
+                yield record
+        if end < self.log_file.stat().st_size:
+            self._truncate_log(end)
+
+    def _truncate_log(self, size: int):
+        print(f"Журнал отзывов обрезан до последней целой записи ({size} байт)")
+        with open(self.log_file, 'r+b') as f:
+            f.truncate(size)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write(self, records: List[dict]):
+        """Дописывает пачку записей в журнал одной записью на диск"""
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_entries += len(records)
+
+    def has_new_ids(self) -> bool:
+        """Выданы ли при загрузке id, которых ещё нет на диске"""
+        return self._dirty
+
+    def needs_compaction(self) -> bool:
+        return self._dirty or self._log_entries >= COMPACT_THRESHOLD
+
+    def compact(self, reviews: List[dict]):
+        """Записывает текущее состояние в снимок и очищает журнал"""
+        tmp_file = self.snapshot_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(reviews[::-1], f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        fsync_dir(self.snapshot_file.parent)
+        # Журнал очищается только после того, как снимок надёжно на месте
+        open(self.log_file, 'w').close()
+        self._log_entries = 0
+        self._dirty = False
+
+
+def fsync_dir(path: Path):
+    """Сбрасывает на диск запись каталога (нужно после rename)"""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ConnectionPool:
+    """Небольшой пул соединений с SQLite, которые можно отдавать в любой поток"""
+
+    def __init__(self, db_file: Path, size: int):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(
+                db_file,
+                check_same_thread=False,
+                isolation_level=None,  # транзакции открываются явно
+                cached_statements=64,  # подготовленные запросы переиспользуются
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 5000")
+            # FULL: подтверждённая транзакция переживает и отключение питания
+            conn.execute("PRAGMA synchronous = FULL")
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+class SqliteStorage:
+    """
+    Отзывы в SQLite в режиме WAL.
+
+    Читатели не блокируются, пока идёт запись. При первом запуске
+    в базу один раз импортируются отзывы из reviews.json.
+    """
+
+    SELECT_ALL = "SELECT id, name, handle, city, avatar, rating, text FROM reviews ORDER BY seq"
+    INSERT = (
+        "INSERT INTO reviews (id, name, handle, city, avatar, rating, text) "
+        "VALUES (:id, :name, :handle, :city, :avatar, :rating, :text)"
+    )
+    DELETE = "DELETE FROM reviews WHERE id = ?"
+
+    def __init__(self, db_file: Path, legacy_storage: JsonLogStorage, pool_size: int = DB_POOL_SIZE):
+        self.db_file = db_file
+        self.legacy_storage = legacy_storage
+        self.pool_size = pool_size
+        self._pool: Optional[ConnectionPool] = None
+
+    def _open(self):
+        self._pool = ConnectionPool(self.db_file, self.pool_size)
+        with self._pool.connection() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS reviews (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT,
+                    name TEXT NOT NULL,
+                    handle TEXT NOT NULL,
+                    city TEXT NOT NULL,
+                    avatar TEXT NOT NULL,
+                    rating INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS reviews_rating ON reviews (rating);
+                CREATE INDEX IF NOT EXISTS reviews_city ON reviews (city);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            self._migrate(conn)
+            self._migrate_ids(conn)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Однократный импорт отзывов из reviews.json"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone() is None:
+                reviews = self.legacy_storage.load()
+                conn.executemany(self.INSERT, reviews)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('imported', ?)", (str(len(reviews)),))
+                print(f"Импортировано отзывов в {self.db_file.name}: {len(reviews)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _migrate_ids(self, conn: sqlite3.Connection):
+        """Добавляет идентификаторы в базу, созданную до их появления"""
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(reviews)")]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if "id" not in columns:
+                conn.execute("ALTER TABLE reviews ADD COLUMN id TEXT")
+            rows = [dict(row) for row in conn.execute("SELECT seq, id FROM reviews ORDER BY seq")]
+            if ensure_ids(rows):
+                conn.executemany("UPDATE reviews SET id = :id WHERE seq = :seq", rows)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS reviews_id ON reviews (id)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self) -> List[dict]:
+        if self._pool is None:
+            self._open()
+        with self._pool.connection() as conn:
+            return [dict(row) for row in conn.execute(self.SELECT_ALL)]
+
+    def write(self, records: List[dict]):
+        """Применяет записи одной транзакцией"""
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    if record["op"] == "add":
+                        conn.execute(self.INSERT, record["review"])
+                    elif record["op"] == "delete":
+                        conn.execute(self.DELETE, (record["id"],))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def has_new_ids(self) -> bool:
+        return False
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def compact(self, reviews: List[dict]):
+        pass
+
+
+# Поля, по которым можно фильтровать отзывы
+INDEXED_FIELDS = ("rating", "city", "handle")
+
+
+def index_key(field: str, value):
+    """Нормализует значение поля для поиска по индексу"""
+    if field == "rating":
+        return int(value)
+    if field == "handle":
+        return str(value).strip().lstrip("@").casefold()
+    return str(value).strip().casefold()
+
+
+class ReviewStats:
+    """Сводка по отзывам, которая обновляется на месте при каждом изменении"""
+
+    def __init__(self):
+        self.total = 0
+        self.rating_sum = 0
+        self.ratings: Dict[int, int] = {rating: 0 for rating in range(1, 6)}
+        # Города считаются как в фильтре (index_key), показываются в первом встреченном написании
+        self.cities: Dict[str, int] = {}
+        self.city_names: Dict[str, str] = {}
+
+    def add(self, review: dict):
+        self._update(review, 1)
+
+    def remove(self, review: dict):
+        self._update(review, -1)
+
+    def _update(self, review: dict, delta: int):
+        rating = review["rating"]
+        city = index_key("city", review["city"])
+        self.total += delta
+        self.rating_sum += rating * delta
+        self.ratings[rating] = self.ratings.get(rating, 0) + delta
+        self.cities[city] = self.cities.get(city, 0) + delta
+        self.city_names.setdefault(city, review["city"].strip())
+        if not self.cities[city]:
+            del self.cities[city]
+            del self.city_names[city]
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "average_rating": round(self.rating_sum / self.total, 2) if self.total else None,
+            "ratings": {str(rating): self.ratings.get(rating, 0) for rating in range(1, 6)},
+            "cities": {self.city_names[city]: count for city, count in self.cities.items()},
+        }
+
+
+class ReviewStore:
+    """
+    Отзывы загружаются один раз при старте и дальше живут в памяти,
+    поэтому чтение вообще не трогает диск. Изменения передаются в хранилище
+    (JsonLogStorage или SqliteStorage) через ReviewWriter.
+
+    У каждого отзыва есть постоянный сортируемый id. Отзывы доступны по id
+    из словаря, а для полей из INDEXED_FIELDS поддерживаются отсортированные
+    списки id, так что страница с фильтром стоит порядка размера страницы.
+    Удаление только убирает отзыв из словаря и оставляет надгробие
+    в списках; списки чистит compact() в фоне.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._records: Dict[str, dict] = {}
+        # id отзывов в порядке добавления (старые в начале),
+        # наружу отдаются в обратном порядке - новые сверху
+        self._order: List[str] = []
+        self._indexes: Dict[str, Dict[object, List[str]]] = {}
+        self._tombstones = 0
+        self._stats = ReviewStats()
+        self._search = ReviewSearchIndex()
+        # Версия растёт при каждом изменении; вместе с эпохой процесса
+        # однозначно определяет содержимое хранилища (для ETag)
+        self.version = 0
+        self._epoch = os.urandom(4).hex()
+
+    def load(self):
+        """Загружает отзывы из хранилища"""
+        self.reset(self.storage.load())
+
+    def reset(self, reviews: List[dict]):
+        """Заменяет содержимое памяти списком отзывов (старые в начале)"""
+        self._records = {}
+        self._order = []
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self._tombstones = 0
+        self._stats = ReviewStats()
+        self._search = ReviewSearchIndex()
+        for review in reviews:
+            self._insert(review)
+        if reviews:
+            # Новые id должны быть больше загруженных, даже если их выдал другой процесс
+            new_review_id.observe(reviews[-1]["id"])
+        self.version += 1
+
+    def set_version(self, version: int, epoch: str):
+        """Версия из общего для процессов номера поколения (см. process_sync)"""
+        self.version = version
+        self._epoch = epoch
+
+    def _insert(self, review: dict):
+        review_id = review["id"]
+        self._records[review_id] = review
+        self._order.append(review_id)
+        for field in INDEXED_FIELDS:
+            self._indexes[field].setdefault(index_key(field, review[field]), []).append(review_id)
+        self._stats.add(review)
+        self._search.add(review)
+        return review
+
+    def _remove(self, review_id: str) -> dict:
+        self._tombstones += 1
+        review = self._records.pop(review_id)
+        self._stats.remove(review)
+        self._search.remove(review)
+        return review
+
+    def apply(self, ops: List[dict]) -> Tuple[List[dict], list]:
+        """
+        Применяет пачку операций к данным в памяти.
+        Возвращает записи для хранилища и результат каждой операции
+        (отзыв или исключение, если операцию выполнить нельзя).
+        """
+        records, results = [], []
+        for op in ops:
+            if op["op"] == "add":
+                review = dict(op["review"], id=new_review_id())
+                records.append({"op": "add", "review": review})
+                results.append(self._insert(review))
+                continue
+            review_id = op.get("id")
+            if review_id is None:
+                review_id = self._id_at(op["index"])
+            if review_id not in self._records:
+                results.append(KeyError(review_id))
+                continue
+            records.append({"op": "delete", "id": review_id})
+            results.append(self._remove(review_id))
+        if records:
+            self.version += 1
+        return records, results
+
+    def _id_at(self, index: int) -> Optional[str]:
+        """id отзыва по индексу в списке (новые сверху); O(index + надгробия)"""
+        if index < 0 or index >= len(self._records):
+            return None
+        for review_id in reversed(self._order):
+            if review_id in self._records:
+                if index == 0:
+                    return review_id
+                index -= 1
+        return None
+
+    def needs_compaction(self) -> bool:
+        return self._tombstones > max(COMPACT_THRESHOLD, len(self._records) // 4)
+
+    def compact(self):
+        """Убирает надгробия из списков; O(N), поэтому вызывается в фоне"""
+        if not self._tombstones:
+            return
+        self._order = [review_id for review_id in self._order if review_id in self._records]
+        for field in INDEXED_FIELDS:
+            index = {}
+            for key, postings in self._indexes[field].items():
+                postings = [review_id for review_id in postings if review_id in self._records]
+                if postings:
+                    index[key] = postings
+            self._indexes[field] = index
+        self._tombstones = 0
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._epoch}-{self.version}"'
+
+    def stats(self) -> dict:
+        return self._stats.as_dict()
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        """Отзывы, в тексте, имени или городе которых есть все слова запроса"""
+        return [self._records[review_id] for review_id in self._search.search(query)[:limit]]
+
+    def get(self, review_id: str) -> Optional[dict]:
+        return self._records.get(review_id)
+
+    def snapshot(self) -> List[dict]:
+        """Копия всех отзывов в порядке добавления (старые в начале)"""
+        return list(self._records.values())
+
+    def list(self) -> List[dict]:
+        """Все отзывы, новые сверху"""
+        return list(reversed(self._records.values()))
+
+    def page(self, limit: Optional[int] = None, cursor: Optional[str] = None,
+             **filters) -> Tuple[List[dict], Optional[str]]:
+        """
+        Страница отзывов (новые сверху), начиная с отзывов старше cursor.
+        Возвращает отзывы и курсор следующей страницы (None, если это конец).
+        """
+        filters = {field: index_key(field, value) for field, value in filters.items() if value is not None}
+        candidates = self._order
+        if filters:
+            postings = [self._indexes[field].get(key) for field, key in filters.items()]
+            if not all(postings):
+                return [], None
+            # Идём по самому короткому индексу, остальные фильтры проверяем на месте
+            candidates = min(postings, key=len)
+        end = bisect_left(candidates, cursor) if cursor is not None else len(candidates)
+
+        reviews = []
+        for i in range(end - 1, -1, -1):
+            review = self._records.get(candidates[i])
+            if review is None:
+                continue
+            if any(index_key(field, review[field]) != key for field, key in filters.items()):
+                continue
+            reviews.append(review)
+            if limit is not None and len(reviews) == limit:
+                return reviews, (review["id"] if i > 0 else None)
+        return reviews, None
+
+    def __len__(self):
+        return len(self._records)
+
+
+def timed(operation: str, func, *args):
+    """Вызов операции хранилища с замером времени (выполняется в потоке)"""
+    with REVIEWS_STORAGE_SECONDS.time(operation):
+        return func(*args)
+
+
+def resolve(batch: list, results: list):
+    """Отдаёт ожидающим обработчикам результат (отзыв или исключение) их операций"""
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+class ReviewWriter:
+    """
+    Фоновая запись изменений с групповой фиксацией.
+
+    Обработчики ставят операции в очередь и ждут их фиксации. Единственный
+    писатель забирает из очереди всё накопившееся, применяет пачку к памяти
+    и сохраняет её одной записью на диск в отдельном потоке, не блокируя
+    event loop. N одновременных отзывов превращаются в одну запись.
+
+    Если передан shared (process_sync.SharedState), хранилище делят несколько
+    процессов: запись идёт под межпроцессной блокировкой, после неё номер
+    поколения увеличивается, а refresh() перечитывает данные, когда номер
+    изменил другой процесс.
+    """
+
+    def __init__(self, store: ReviewStore, max_batch: int = WRITE_BATCH_SIZE, shared=None):
+        self.store = store
+        self.max_batch = max_batch
+        self.shared = shared
+        self._seen_generation: Optional[int] = None
+        # Память разошлась с диском (запись не удалась) - перечитать перед следующей
+        self._needs_reload = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Перечитывание данных и фиксация не должны перемежаться
+        self._state_lock: Optional[asyncio.Lock] = None
+
+    async def start(self):
+        """Загружает отзывы и запускает писателя"""
+        self._queue = asyncio.Queue()
+        self._state_lock = asyncio.Lock()
+        # При общем хранилище _exclusive() сам загрузит данные под блокировкой
+        async with self._exclusive():
+            if self.shared is None:
+                await self._reload(locked=False)
+            if self.store.storage.has_new_ids():
+                # Отзывы из старых версий файла получили id при загрузке. Сохраняем
+                # их сразу и под блокировкой: иначе каждый процесс выдал бы тем же
+                # отзывам свои id, и удаление в одном не нашлось бы на диске
+                await self._compact_storage()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дожидается записи всего, что уже в очереди, и останавливает писателя"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, op: dict):
+        """Ставит операцию в очередь и ждёт её фиксации на диске"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def add(self, review: dict) -> dict:
+        return await self.submit({"op": "add", "review": review})
+
+    async def delete(self, index: int) -> dict:
+        return await self.submit({"op": "delete", "index": index})
+
+    async def delete_by_id(self, review_id: str) -> dict:
+        return await self.submit({"op": "delete", "id": review_id})
+
+    def is_stale(self) -> bool:
+        """Изменил ли данные другой процесс; это чтение из отображённой памяти"""
+        return self._needs_reload or (
+            self.shared is not None and self.shared.generation.value != self._seen_generation
+        )
+
+    async def refresh(self):
+        """Подхватывает изменения, сделанные другими процессами"""
+        if not self.is_stale():
+            return
+        async with self._state_lock:
+            if self.is_stale():
+                try:
+                    await self._reload(locked=False)
+                except Exception as e:
+                    # Отдаём то, что в памяти; перечитаем при следующем запросе
+                    print(f"Ошибка при перечитывании отзывов: {e}")
+
+    def _load(self, locked: bool):
+        """Читает хранилище; без эксклюзивной блокировки - под разделяемой"""
+        if self.shared is None:
+            with REVIEWS_STORAGE_SECONDS.time("load"):
+                return None, self.store.storage.load()
+        if not locked:
+            self.shared.read_lock.acquire(shared=True)
+        try:
+            with REVIEWS_STORAGE_SECONDS.time("load"):
+                return self.shared.generation.value, self.store.storage.load()
+        finally:
+            if not locked:
+                self.shared.read_lock.release()
+
+    async def _reload(self, locked: bool):
+        generation, reviews = await asyncio.get_running_loop().run_in_executor(None, self._load, locked)
+        self.store.reset(reviews)
+        self._needs_reload = False
+        self._synced(generation)
+
+    def _synced(self, generation: Optional[int]):
+        if generation is not None:
+            self._seen_generation = generation
+            self.store.set_version(generation, self.shared.generation.epoch)
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Единоличный доступ к хранилищу с актуальными данными в памяти"""
+        async with self._state_lock:
+            if self.shared is None:
+                if self._needs_reload:
+                    await self._reload(locked=False)
+                yield
+                return
+            await asyncio.get_running_loop().run_in_executor(None, self.shared.write_lock.acquire)
+            try:
+                if self.is_stale():
+                    # Пока ждали блокировку, в хранилище писали другие процессы
+                    await self._reload(locked=True)
+                yield
+            finally:
+                self.shared.write_lock.release()
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = await asyncio.wait_for(self._queue.get(), COMPACT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Писатель простаивает - самое время убрать надгробия
+                await self._compact(force=True)
+                continue
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_batch or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+            if batch:
+                try:
+                    async with self._exclusive():
+                        await self._commit(batch)
+                except Exception as e:
+                    # Писатель должен жить дальше: иначе все следующие запросы ждали бы вечно
+                    print(f"Ошибка при сохранении отзывов: {e}")
+                    resolve(batch, [e] * len(batch))
+                await self._compact()
+
+    async def _commit(self, batch: list):
+        loop = asyncio.get_running_loop()
+        storage = self.store.storage
+        records, results = self.store.apply([op for op, _ in batch])
+        try:
+            if records:
+                await loop.run_in_executor(None, timed, "write", storage.write, records)
+                if self.shared is not None:
+                    self._synced(self.shared.generation.bump())
+        except Exception as e:
+            print(f"Ошибка при сохранении отзывов: {e}")
+            # Память уже изменена, а диск нет - перечитываем состояние с диска
+            # (не получится сейчас - перечитаем перед следующей записью)
+            self._needs_reload = True
+            results = [e] * len(batch)
+            try:
+                await self._reload(locked=True)
+            except Exception as reload_error:
+                print(f"Ошибка при перечитывании отзывов: {reload_error}")
+        resolve(batch, results)
+
+    async def _compact(self, force: bool = False):
+        """
+        Чистит надгробия в памяти и сворачивает журнал хранилища.
+        Выполняется только писателем, поэтому не пересекается с записью.
+        """
+        if force or self.store.needs_compaction():
+            self.store.compact()
+        storage = self.store.storage
+        if not storage.needs_compaction():
+            return
+        try:
+            async with self._exclusive():
+                await self._compact_storage()
+        except Exception as e:
+            print(f"Ошибка при сжатии журнала отзывов: {e}")
+
+    async def _compact_storage(self):
+        """Сворачивает журнал в снимок; вызывается внутри _exclusive()"""
+        storage = self.store.storage
+        new_ids = storage.has_new_ids()
+        await asyncio.get_running_loop().run_in_executor(
+            None, timed, "compact", storage.compact, self.store.snapshot()
+        )
+        if new_ids and self.shared is not None:
+            # В снимке появились id, которых нет у других процессов - пусть перечитают
+            self._synced(self.shared.generation.bump())
@@ -0,0 +1,295 @@
+"""
+Раздача Mini App (папка docs/) из бэкенда: отпечатки файлов, предсжатые копии, Range и sendfile
+"""
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+import anyio
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+# Файлы по URL с отпечатком никогда не меняются
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Остальное браузер проверяет при каждом открытии (обычно 304)
+REVALIDATE_CACHE = "no-cache"
+
+CHUNK_SIZE = 64 * 1024
+
+# Предсжатые копии рядом с файлом: name.ext.br / name.ext.gz
+ENCODING_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+FINGERPRINT_RE = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class Asset:
+    """Файл из манифеста"""
+
+    def __init__(self, path: Path, rel_path: str):
+        self.path = path
+        self.rel_path = rel_path
+        stat = path.stat()
+        self.size = stat.st_size
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        self.hash = digest.hexdigest()[:12]
+        self.etag = f'"{self.hash}"'
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.encoded: Dict[str, Path] = {}
+        for encoding, suffix in ENCODING_SUFFIXES:
+            sibling = path.with_name(path.name + suffix)
+            if sibling.exists():
+                self.encoded[encoding] = sibling
+
+    @property
+    def fingerprinted_url(self) -> str:
+        stem, dot, ext = self.rel_path.rpartition(".")
+        if not dot or "/" in ext:
+            return f"{self.rel_path}.{self.hash}"
+        return f"{stem}.{self.hash}.{ext}"
+
+
+def accepts(request: Request, encoding: str) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() == encoding:
+            return params.strip() not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Один диапазон из заголовка Range -> (start, end) включительно.
+    None - диапазон не задан или их несколько (тогда отдаём файл целиком).
+    ValueError - диапазон за пределами файла (416).
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N: последние N байт
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """
+    Отдача части файла. Если сервер поддерживает расширение ASGI
+    http.response.zerocopysend, файл уходит через sendfile без копирования
+    в пользовательское пространство, иначе читается кусками в потоке.
+    """
+
+    def __init__(self, path: Path, start: int, length: int, status_code: int,
+                 headers: dict, media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or not self.length:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                })
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b""})
+
+
+class StaticAssets:
+    """
+    ASGI-приложение для папки docs/.
+
+    При старте строит манифест с хэшами содержимого. Файл доступен и по
+    обычному пути (проверяется по ETag), и по пути с отпечатком
+    (images/head2.<hash>.jpg), который кэшируется навсегда. В index.html
+    ссылки на файлы из манифеста заменяются на пути с отпечатками, поэтому
+    при повторном открытии Mini App перепроверяется только сама страница.
+    """
+
+    def __init__(self, directory: Path, index: str = "index.html"):
+        self.directory = directory
+        self.index = index
+        self.assets: Dict[str, Asset] = {}
+        self._index_variants: Dict[str, bytes] = {}
+        self._index_etag = ""
+
+    def build_manifest(self):
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith((".br", ".gz")):
+                    continue
+                path = Path(root) / name
+                rel_path = path.relative_to(self.directory).as_posix()
+                assets[rel_path] = Asset(path, rel_path)
+        self.assets = assets
+        self._build_index()
+        print(f"Статика: {len(assets)} файлов из {self.directory}")
+
+    def _build_index(self):
+        """index.html со ссылками на файлы с отпечатками, сжатый заранее"""
+        index_asset = self.assets.get(self.index)
+        if index_asset is None:
+            return
+        html = index_asset.path.read_text(encoding="utf-8")
+
+        def fingerprint(match: re.Match) -> str:
+            asset = self.assets.get(match.group(2))
+            if asset is None or asset.rel_path == self.index:
+                return match.group(0)
+            return match.group(1) + asset.fingerprinted_url + match.group(3)
+
+        body = re.sub(r"""(["'(])([^"'()\s<>]+)(["')])""", fingerprint, html).encode("utf-8")
+        self._index_etag = f'"{hashlib.sha256(body).hexdigest()[:12]}"'
+        self._index_variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self._index_variants["br"] = brotli.compress(body, quality=11)
+
+    def url_for(self, rel_path: str) -> str:
+        """Путь с отпечатком для файла из манифеста (или исходный путь)"""
+        asset = self.assets.get(rel_path)
+        return asset.fingerprinted_url if asset else rel_path
+
+    def lookup(self, rel_path: str) -> Tuple[Optional[Asset], bool]:
+        """Файл по пути запроса и признак того, что путь был с верным отпечатком"""
+        asset = self.assets.get(rel_path)
+        if asset is not None:
+            return asset, False
+        match = FINGERPRINT_RE.match(rel_path)
+        if match:
+            asset = self.assets.get(match.group("stem") + match.group("ext"))
+            if asset is not None:
+                return asset, asset.hash == match.group("hash")
+        return None, False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request = Request(scope, receive)
+        response = self.get_response(request, self._sub_path(scope))
+        await response(scope, receive, send)
+
+    def _sub_path(self, scope: Scope) -> str:
+        """Путь внутри точки монтирования (разные версии Starlette передают его по-разному)"""
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path.lstrip("/")
+
+    def get_response(self, request: Request, rel_path: str) -> Response:
+        if request.method not in ("GET", "HEAD"):
+            return Response(status_code=405, headers={"Allow": "GET, HEAD"})
+        if rel_path in ("", self.index):
+            return self._index_response(request)
+        asset, immutable = self.lookup(rel_path)
+        if asset is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        return self.file_response(request, asset, immutable)
+
+    def _index_response(self, request: Request) -> Response:
+        if not self._index_variants:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        headers = {"ETag": self._index_etag, "Cache-Control": REVALIDATE_CACHE, "Vary": "Accept-Encoding"}
+        if etag_matches(request, self._index_etag):
+            return Response(status_code=304, headers=headers)
+        encoding = next((e for e in ("br", "gzip") if e in self._index_variants and accepts(request, e)), "identity")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        body = self._index_variants[encoding] if request.method == "GET" else b""
+        response = Response(body, headers=headers, media_type="text/html")
+        if request.method == "HEAD":
+            response.headers["content-length"] = str(len(self._index_variants[encoding]))
+        return response
+
+    def file_response(self, request: Request, asset: Asset, immutable: bool = False) -> Response:
+        """Ответ с файлом: 304, предсжатая копия, часть файла (206) или файл целиком"""
+        headers = {
+            "ETag": asset.etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+            "Accept-Ranges": "bytes",
+        }
+        if asset.encoded:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(request, asset.etag):
+            return Response(status_code=304, headers=headers)
+        send_body = request.method == "GET"
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range.strip() == asset.etag):
+            try:
+                byte_range = parse_range(range_header, asset.size)
+            except ValueError:
+                headers["Content-Range"] = f"bytes */{asset.size}"
+                return Response(status_code=416, headers=headers)
+            if byte_range is not None:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+                return FileRangeResponse(asset.path, start, end - start + 1, 206, headers,
+                                         asset.media_type, send_body)
+
+        # Диапазоны считаются по исходному файлу, поэтому сжатая копия - только целиком
+        path, size = asset.path, asset.size
+        for encoding, encoded_path in asset.encoded.items():
+            if accepts(request, encoding):
+                headers["Content-Encoding"] = encoding
+                path, size = encoded_path, encoded_path.stat().st_size
+                break
+        return FileRangeResponse(path, 0, size, 200, headers, asset.media_type, send_body)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (общая проверка для статики и API)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
@@ -0,0 +1,155 @@
+"""
+Проверка хранилища отзывов: несколько процессов uvicorn, сбои записи, оборванный журнал
+
+Запуск (из папки backend):
+    python -m pytest test_review_store.py
+"""
+from pathlib import Path
+import asyncio
+import json
+import tempfile
+import unittest
+
+from process_sync import SharedState
+from review_store import JsonLogStorage, ReviewStore, ReviewWriter
+
+
+def legacy_review(number: int) -> dict:
+    """Отзыв в формате старых версий reviews.json - без id"""
+    return {
+        "name": f"Гость {number}",
+        "handle": f"@guest{number}",
+        "city": "Москва",
+        "avatar": "",
+        "rating": 5,
+        "text": f"Отзыв номер {number}",
+    }
+
+
+class SharedLegacyReviewsTest(unittest.IsolatedAsyncioTestCase):
+    """Два процесса стартуют на reviews.json без id (обновление старой установки)"""
+
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._tmp.name)
+        with open(self.data_dir / "reviews.json", "w", encoding="utf-8") as f:
+            json.dump([legacy_review(number) for number in range(3)], f, ensure_ascii=False)
+        self.writers = []
+
+    async def asyncTearDown(self):
+        for writer in self.writers:
+            await writer.stop()
+        self._tmp.cleanup()
+
+    async def start_worker(self) -> ReviewWriter:
+        """Отдельные хранилище, память и блокировки - как у другого процесса"""
+        storage = JsonLogStorage(self.data_dir / "reviews.json", self.data_dir / "reviews.log", [])
+        writer = ReviewWriter(ReviewStore(storage), shared=SharedState(self.data_dir, "reviews"))
+        await writer.start()
+        self.writers.append(writer)
+        return writer
+
+    def ids(self, writer: ReviewWriter) -> list:
+        return [review["id"] for review in writer.store.list()]
+
+    async def test_workers_agree_on_legacy_ids(self):
+        worker_a = await self.start_worker()
+        worker_b = await self.start_worker()
+        await worker_b.refresh()
+        self.assertEqual(self.ids(worker_a), self.ids(worker_b))
+
+    async def test_delete_is_seen_by_other_worker_and_after_restart(self):
+        worker_a = await self.start_worker()
+        worker_b = await self.start_worker()
+
+        deleted = await worker_a.delete_by_id(self.ids(worker_a)[0])
+
+        await worker_b.refresh()
+        self.assertEqual(len(worker_b.store), 2)
+        self.assertIsNone(worker_b.store.get(deleted["id"]))
+
+        # Перезапуск: все данные читаются с диска заново
+        restarted = await self.start_worker()
+        self.assertEqual(len(restarted.store), 2)
+        self.assertEqual(self.ids(restarted), self.ids(worker_a))
+
+
+class TornLogTest(unittest.IsolatedAsyncioTestCase):
+    """Процесс упал посреди записи в журнал"""
+
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._tmp.name)
+
+    async def asyncTearDown(self):
+        self._tmp.cleanup()
+
+    async def start_writer(self) -> ReviewWriter:
+        storage = JsonLogStorage(self.data_dir / "reviews.json", self.data_dir / "reviews.log", [])
+        writer = ReviewWriter(ReviewStore(storage))
+        await writer.start()
+        return writer
+
+    async def test_record_after_torn_line_survives_restart(self):
+        writer = await self.start_writer()
+        await writer.add(legacy_review(0))
+        await writer.stop()
+        with open(self.data_dir / "reviews.log", "a", encoding="utf-8") as f:
+            f.write('{"op": "add", "review": {"name": "TORN')
+
+        writer = await self.start_writer()
+        await writer.add(legacy_review(1))
+        await writer.stop()
+
+        writer = await self.start_writer()
+        self.assertEqual([review["text"] for review in writer.store.list()],
+                         [legacy_review(1)["text"], legacy_review(0)["text"]])
+        await writer.stop()
+
+
+class BrokenStorage(JsonLogStorage):
+    """Хранилище, в котором можно сломать запись и чтение"""
+
+    fail_write = False
+    fail_load = False
+
+    def write(self, records):
+        if self.fail_write:
+            raise OSError("диск недоступен")
+        super().write(records)
+
+    def load(self):
+        if self.fail_load:
+            raise OSError("журнал не читается")
+        return super().load()
+
+
+class WriterFailureTest(unittest.IsolatedAsyncioTestCase):
+    """Ошибка записи не должна останавливать фонового писателя"""
+
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        data_dir = Path(self._tmp.name)
+        self.storage = BrokenStorage(data_dir / "reviews.json", data_dir / "reviews.log", [legacy_review(0)])
+        self.writer = ReviewWriter(ReviewStore(self.storage))
+        await self.writer.start()
+
+    async def asyncTearDown(self):
+        await self.writer.stop()
+        self._tmp.cleanup()
+
+    async def test_writer_survives_failed_write_and_reload(self):
+        self.storage.fail_write = self.storage.fail_load = True
+        with self.assertRaises(OSError):
+            await asyncio.wait_for(self.writer.add(legacy_review(1)), 5)
+        self.assertFalse(self.writer._task.done())
+
+        self.storage.fail_write = self.storage.fail_load = False
+        review = await asyncio.wait_for(self.writer.add(legacy_review(2)), 5)
+        # Неудачный отзыв не остался в памяти, удачный - записан
+        self.assertEqual([item["text"] for item in self.writer.store.list()],
+                         [review["text"], legacy_review(0)["text"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
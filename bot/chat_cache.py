@@ -0,0 +1,67 @@
+"""
+Кэш имён пользователей (get_chat) с ограниченным сроком жизни и размером
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+# Сколько секунд имя считается свежим
+CHAT_CACHE_TTL = float(os.getenv('CHAT_CACHE_TTL', 3600))
+# Сколько чатов держать в памяти (давно не нужные вытесняются первыми)
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 10_000))
+
+
+class ChatCache:
+    """
+    chat_id -> first_name. Заполняется бесплатно: каждое обновление уже несёт
+    from_user, и remember() запоминает его имя. get_chat вызывается только
+    для тех, кто боту ещё не писал (или давно), причём одновременные запросы
+    одного chat_id ждут один и тот же вызов API.
+    """
+
+    def __init__(self, ttl: float = CHAT_CACHE_TTL, max_size: int = CHAT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # chat_id -> (когда устареет, имя)
+        self._entries: "OrderedDict[int, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Task] = {}
+
+    def remember(self, chat_id: int, first_name: Optional[str]) -> None:
+        self._entries[chat_id] = (time.monotonic() + self.ttl, first_name)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, chat_id: int) -> Tuple[bool, Optional[str]]:
+        """(есть ли свежая запись, имя)"""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return False, None
+        expires, first_name = entry
+        if expires <= time.monotonic():
+            del self._entries[chat_id]
+            return False, None
+        self._entries.move_to_end(chat_id)
+        return True, first_name
+
+    async def first_name(self, bot, chat_id: int) -> Optional[str]:
+        """Имя из кэша или из get_chat; если чат не найден - исключение get_chat"""
+        found, first_name = self.get(chat_id)
+        if found:
+            return first_name
+        task = self._inflight.get(chat_id)
+        if task is None:
+            task = self._inflight[chat_id] = asyncio.ensure_future(self._fetch(bot, chat_id))
+            task.add_done_callback(lambda _: self._inflight.pop(chat_id, None))
+        # shield: если ожидающего отменят, запрос для остальных продолжится
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot, chat_id: int) -> Optional[str]:
+        chat = await bot.get_chat(chat_id)
+        self.remember(chat_id, chat.first_name)
+        return chat.first_name
+
+    def __len__(self) -> int:
+        return len(self._entries)
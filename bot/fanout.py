@@ -0,0 +1,135 @@
+"""
+Рассылка одному отправителю - многим получателям: параллельно, но в пределах лимитов Telegram
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, TypeVar
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Telegram: не больше ~30 сообщений в секунду от бота всего
+SEND_RATE = float(os.getenv('BOT_SEND_RATE', 30))
+# и не больше ~1 сообщения в секунду в один чат (короткие всплески допустимы)
+CHAT_SEND_RATE = float(os.getenv('BOT_CHAT_SEND_RATE', 1))
+CHAT_SEND_BURST = float(os.getenv('BOT_CHAT_SEND_BURST', 3))
+# Сколько корзин чатов держать в памяти
+MAX_CHAT_BUCKETS = 10_000
+
+
+class AsyncTokenBucket:
+    """
+    rate запросов в секунду с запасом burst. Ожидающие обслуживаются по
+    очереди (asyncio.Lock честный), поэтому сообщения в один чат не
+    обгоняют друг друга.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            await self.take()
+
+    async def take(self):
+        """Ждёт жетон без блокировки (вызывающий сам держит lock)"""
+        while True:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Telegram попросил подождать (RetryAfter) - забираем жетоны на это время"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_idle(self, now: float) -> bool:
+        """Корзина полна и никем не занята - её можно забыть"""
+        return not self.lock.locked() and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+@dataclass
+class FanOutResult:
+    delivered: List[int] = field(default_factory=list)
+    failed: Dict[int, Exception] = field(default_factory=dict)
+
+
+class FanOut:
+    """
+    Отправка запросов Bot API с общим лимитом и лимитом на каждый чат.
+    broadcast() обрабатывает всех получателей одновременно: каждый вызов
+    API ждёт жетон своего чата, потом общий. Ошибка одного получателя не
+    мешает остальным - она попадает в FanOutResult.failed.
+    """
+
+    def __init__(self, rate: float = SEND_RATE, chat_rate: float = CHAT_SEND_RATE,
+                 chat_burst: float = CHAT_SEND_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = AsyncTokenBucket(rate, rate)
+        self._chats: "OrderedDict[int, AsyncTokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> AsyncTokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = AsyncTokenBucket(self.chat_rate, self.chat_burst)
+            self._expire()
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _expire(self):
+        now = time.monotonic()
+        while len(self._chats) > MAX_CHAT_BUCKETS:
+            chat_id, bucket = next(iter(self._chats.items()))
+            if not bucket.is_idle(now):
+                break
+            del self._chats[chat_id]
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[T]]) -> T:
+        """Один вызов API в чат chat_id; при RetryAfter ждёт и повторяет один раз"""
+        chat_bucket = self._chat_bucket(chat_id)
+        # Чат занят до конца вызова (и повтора), чтобы сообщения в него шли строго по очереди
+        async with chat_bucket.lock:
+            await chat_bucket.take()
+            await self._global.acquire()
+            try:
+                return await call()
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"Telegram просит подождать {delay} с перед отправкой в {chat_id}")
+                self._global.pause(delay)
+                await asyncio.sleep(delay)
+                await self._global.acquire()
+                return await call()
+
+    async def broadcast(self, receivers: Iterable[int],
+                        deliver: Callable[[int], Awaitable[None]]) -> FanOutResult:
+        """deliver(receiver_id) для всех получателей одновременно; внутри - вызовы через send()"""
+        receivers = list(receivers)
+        results = await asyncio.gather(*(deliver(receiver_id) for receiver_id in receivers), return_exceptions=True)
+        result = FanOutResult()
+        for receiver_id, outcome in zip(receivers, results):
+            if isinstance(outcome, Exception):
+                result.failed[receiver_id] = outcome
+            else:
+                result.delivered.append(receiver_id)
+        return result
@@ -0,0 +1,222 @@
+"""
+Трансляция геолокации в реальном времени (live location) получателям с прореживанием обновлений
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+import asyncio
+import logging
+import os
+import time
+
+from telegram import Location, Message
+from telegram.error import BadRequest
+from telegram.ext import Application
+
+from fanout import FanOut
+
+logger = logging.getLogger(__name__)
+
+# Не чаще одного обновления геолокации отправителя за столько секунд;
+# всё, что пришло в промежутке, схлопывается в последнюю точку
+LIVE_LOCATION_INTERVAL = float(os.getenv('LIVE_LOCATION_INTERVAL', 5))
+# Telegram: live_period от минуты до суток, 0x7FFFFFFF - бессрочно
+MIN_LIVE_PERIOD = 60
+MAX_LIVE_PERIOD = 86400
+FOREVER = 0x7FFFFFFF
+
+
+@dataclass
+class LiveShare:
+    """Трансляция одного отправителя"""
+    sender_name: str
+    # Когда трансляция у отправителя закончится (None - бессрочная)
+    expires_at: Optional[datetime]
+    # Сообщение отправителя, правками которого приходят точки
+    message_id: int
+    # Получатель -> id сообщения с live-геолокацией в его чате
+    messages: Dict[int, int] = field(default_factory=dict)
+    # Последняя ещё не отправленная точка
+    latest: Optional[Location] = None
+    sent_at: float = 0.0
+    task: Optional[asyncio.Task] = None
+    # Таймер, который забудет трансляцию в expires_at (Telegram об этом ничего не присылает)
+    expiry: Optional[asyncio.TimerHandle] = None
+
+    def live_period(self) -> int:
+        """Сколько ещё показывать новое сообщение получателю"""
+        if self.expires_at is None:
+            return FOREVER
+        left = (self.expires_at - datetime.now(timezone.utc)).total_seconds()
+        return int(min(MAX_LIVE_PERIOD, max(MIN_LIVE_PERIOD, left)))
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and datetime.now(timezone.utc) >= self.expires_at
+
+
+class LiveLocationRelay:
+    """
+    Live-геолокация приходит потоком edited_message - на каждое изменение
+    координат. Получатель видит одно сообщение с live-геолокацией, которое
+    бот редактирует (edit_message_live_location), а не новое сообщение на
+    каждую точку.
+
+    Обновления схлопываются по отправителю: пока идёт рассылка или не прошёл
+    interval с прошлой, запоминается только последняя точка. Поэтому на
+    одного получателя уходит не больше 60 / interval запросов в минуту, как
+    бы часто ни обновлялся GPS. Все запросы идут через FanOut с его лимитами.
+    """
+
+    def __init__(self, fanout: FanOut, sessions, interval: float = LIVE_LOCATION_INTERVAL):
+        self.fanout = fanout
+        self.sessions = sessions
+        self.interval = interval
+        self._shares: Dict[int, LiveShare] = {}
+
+    def is_live(self, sender_id: int) -> bool:
+        return sender_id in self._shares
+
+    async def drain(self) -> None:
+        """Ждёт, пока разойдутся все накопленные точки (нужно load_test.py)"""
+        while True:
+            tasks = [share.task for share in self._shares.values() if share.task is not None]
+            if not tasks:
+                return
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def push(self, application: Application, message: Message) -> None:
+        """Новая точка от отправителя (первое сообщение трансляции или его правка)"""
+        sender = message.from_user
+        location = message.location
+        share = self._shares.get(sender.id)
+        if share is not None and (
+            message.edit_date is None or message.message_id != share.message_id or share.expired()
+        ):
+            # Отправитель начал новую трансляцию - прежняя больше не обновится
+            self._end(application, sender.id, share)
+            share = None
+        if share is None:
+            if location.live_period is None:
+                # Трансляция закончилась, а мы её и не вели
+                return
+            share = self._shares[sender.id] = LiveShare(
+                sender_name=sender.first_name or "Пользователь",
+                expires_at=expires_at(message),
+                message_id=message.message_id,
+            )
+            if share.expires_at is not None:
+                delay = (share.expires_at - datetime.now(timezone.utc)).total_seconds()
+                share.expiry = asyncio.get_running_loop().call_later(
+                    max(0.0, delay), self._forget, sender.id, share
+                )
+        share.latest = location
+        if share.task is None:
+            share.task = application.create_task(self._run(application, sender.id, share))
+
+    async def _run(self, application: Application, sender_id: int, share: LiveShare):
+        try:
+            while share.latest is not None:
+                delay = share.sent_at + self.interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                location, share.latest = share.latest, None
+                share.sent_at = time.monotonic()
+                if share.expired():
+                    # Пока ждали очереди, трансляция у отправителя закончилась
+                    return
+                if location.live_period is None:
+                    # Отправитель остановил трансляцию
+                    self._forget(sender_id, share)
+                    await self._stop_messages(application, sender_id, share.messages.items())
+                    return
+                await self._send(application, sender_id, share, location)
+        finally:
+            share.task = None
+
+    def _forget(self, sender_id: int, share: LiveShare):
+        if self._shares.get(sender_id) is share:
+            del self._shares[sender_id]
+        if share.expiry is not None:
+            share.expiry.cancel()
+            share.expiry = None
+
+    def _end(self, application: Application, sender_id: int, share: LiveShare):
+        """Заменяет прежнюю трансляцию: её сообщения у получателей больше не двигаются"""
+        self._forget(sender_id, share)
+        share.latest = None
+        if share.messages and not share.expired():
+            application.create_task(self._stop_messages(application, sender_id, list(share.messages.items())))
+
+    async def _send(self, application: Application, sender_id: int, share: LiveShare, location: Location):
+        bot = application.bot
+
+        async def deliver(receiver_id: int):
+            message_id = share.messages.get(receiver_id)
+            if message_id is not None:
+                try:
+                    await self.fanout.send(receiver_id, lambda: bot.edit_message_live_location(
+                        receiver_id, message_id,
+                        latitude=location.latitude,
+                        longitude=location.longitude,
+                        horizontal_accuracy=location.horizontal_accuracy,
+                        heading=location.heading,
+                    ))
+                    return
+                except BadRequest as e:
+                    if "not modified" in str(e).lower():
+                        return
+                    # Сообщение удалено или его трансляция истекла - отправим новое
+                    logger.info(f"Не удалось обновить геолокацию у {receiver_id}, отправляем заново: {e}")
+            else:
+                await self.fanout.send(receiver_id, lambda: bot.send_message(
+                    receiver_id,
+                    f"📍 <b>{share.sender_name}</b> делится геолокацией в реальном времени:",
+                    parse_mode='HTML'
+                ))
+            sent = await self.fanout.send(receiver_id, lambda: bot.send_location(
+                receiver_id,
+                latitude=location.latitude,
+                longitude=location.longitude,
+                horizontal_accuracy=location.horizontal_accuracy,
+                heading=location.heading,
+                live_period=share.live_period(),
+            ))
+            share.messages[receiver_id] = sent.message_id
+
+        receivers = self.sessions.receivers(sender_id)
+        result = await self.fanout.broadcast(receivers, deliver)
+        for receiver_id, error in result.failed.items():
+            logger.error(f"Ошибка при обновлении геолокации {sender_id} у {receiver_id}: {error}")
+
+    async def detach(self, application: Application, sender_id: int, receiver_ids: Iterable[int]) -> None:
+        """Сессия завершена - останавливает трансляцию у этих получателей"""
+        share = self._shares.get(sender_id)
+        if share is None:
+            return
+        messages = [(receiver_id, share.messages.pop(receiver_id)) for receiver_id in receiver_ids
+                    if receiver_id in share.messages]
+        await self._stop_messages(application, sender_id, messages)
+
+    async def _stop_messages(self, application: Application, sender_id: int, messages):
+        bot = application.bot
+        messages = dict(messages)
+
+        async def stop(receiver_id: int):
+            await self.fanout.send(receiver_id, lambda: bot.stop_message_live_location(
+                receiver_id, messages[receiver_id]
+            ))
+
+        result = await self.fanout.broadcast(messages, stop)
+        for receiver_id, error in result.failed.items():
+            logger.warning(f"Не удалось остановить геолокацию {sender_id} у {receiver_id}: {error}")
+
+
+def expires_at(message: Message) -> Optional[datetime]:
+    """Когда закончится трансляция: live_period отсчитывается от отправки сообщения"""
+    live_period = message.location.live_period
+    if live_period is None:
+        return None
+    seconds = live_period.total_seconds() if hasattr(live_period, "total_seconds") else live_period
+    if seconds >= FOREVER:
+        return None
+    return message.date + timedelta(seconds=seconds)
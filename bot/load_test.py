@@ -0,0 +1,313 @@
+"""
+Нагрузочный тест бота без сети и токена: синтетические Update прогоняются через настоящие обработчики
+
+Запуск:
+    python load_test.py
+    python load_test.py --users 2000 --locations 5 --concurrency 64 --api-latency 30
+    python load_test.py --live-updates 60 --live-interval 0.5
+    python load_test.py --output load.json
+
+Приложение собирается через build_application() из main.py, но вместо
+настоящего бота в нём FakeBot: он не ходит в Telegram, а запоминает
+исходящие вызовы API и отвечает правдоподобными заглушками (при желании -
+с искусственной задержкой сети). Обновления (/start, /my_id,
+/share_location, геолокации, трансляция геолокации правками сообщения,
+текст, /stop_location) подаются так же, как
+их подаёт сам Application: через update_processor в
+application.process_update. Для каждого типа считается время от получения
+обновления до конца обработки.
+"""
+from collections import Counter, defaultdict
+from itertools import count, zip_longest
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import platform
+import sys
+import time
+
+import telegram
+from telegram import Update
+from telegram.ext import ContextTypes, ExtBot
+
+import main
+from fanout import FanOut
+from live_location import LiveLocationRelay
+
+# Токен нужного формата; FakeBot с ним никуда не обращается
+FAKE_TOKEN = "123456:LOAD-TEST-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FIT", "username": "fit_load_test_bot"}
+
+
+def all_false(cls) -> dict:
+    """Все обязательные флаги класса PTB = False (их набор меняется от версии к версии)"""
+    return {
+        name: False for name, param in inspect.signature(cls).parameters.items()
+        if param.default is param.empty and param.kind is param.POSITIONAL_OR_KEYWORD
+    }
+
+
+# Обязательное поле ChatFullInfo в новых версиях Bot API
+ACCEPTED_GIFT_TYPES = all_false(telegram.AcceptedGiftTypes) if hasattr(telegram, "AcceptedGiftTypes") else None
+
+
+class FakeBot(ExtBot):
+    """Бот, который вместо запросов к Bot API записывает их и отвечает заглушками"""
+
+    def __init__(self, token: str = FAKE_TOKEN, api_latency: float = 0.0):
+        super().__init__(token)
+        # Объекты PTB после создания заморожены
+        with self._unfrozen():
+            self.api_latency = api_latency
+            self.calls: Counter = Counter()
+            self._message_ids = count(1)
+
+    async def _post(self, endpoint: str, data: dict = None, **kwargs):
+        self.calls[endpoint] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        data = data or {}
+        if endpoint == "getMe":
+            return dict(BOT_USER)
+        if endpoint == "getChat":
+            chat_id = int(data["chat_id"])
+            return {
+                "id": chat_id,
+                "type": "private",
+                "first_name": f"User{chat_id}",
+                "accent_color_id": 0,
+                "max_reaction_count": 0,
+                "accepted_gift_types": ACCEPTED_GIFT_TYPES,
+            }
+        if endpoint.startswith(("send", "edit")):
+            chat_id = int(data.get("chat_id", 0))
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": dict(BOT_USER),
+            }
+            if "text" in data:
+                message["text"] = str(data["text"])
+            if "latitude" in data:
+                message["location"] = {"latitude": data["latitude"], "longitude": data["longitude"]}
+            return message
+        return True
+
+
+class UpdateFactory:
+    """Синтетические обновления от пользователей бота"""
+
+    def __init__(self):
+        self._update_ids = count(1)
+
+    def message(self, user_id: int, **fields) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+                **fields,
+            },
+        }
+
+    def command(self, user_id: int, command: str, *args) -> dict:
+        text = " ".join((f"/{command}",) + tuple(str(arg) for arg in args))
+        entity = {"type": "bot_command", "offset": 0, "length": len(command) + 1}
+        return self.message(user_id, text=text, entities=[entity])
+
+    def text(self, user_id: int, text: str) -> dict:
+        return self.message(user_id, text=text)
+
+    def location(self, user_id: int, step: int, **fields) -> dict:
+        return self.message(user_id, location={"latitude": 55.75 + step * 1e-4, "longitude": 37.62 + step * 1e-4, **fields})
+
+    def live_edit(self, live: dict, step: int) -> dict:
+        """Следующая точка трансляции - правка сообщения live, как её присылает Telegram"""
+        message = dict(live["message"])
+        message["location"] = {**message["location"], "latitude": 55.75 + step * 1e-4, "longitude": 37.62 + step * 1e-4}
+        message["edit_date"] = int(time.time())
+        return {"update_id": next(self._update_ids), "edited_message": message}
+
+
+# Обновления подаются волнами, между волнами relay рассылает накопленное:
+# правки трансляции приходят, когда live-сообщения уже у получателей, а сессии
+# закрываются после последней точки - иначе тест не доходил бы до правок
+PHASES = (
+    ("start", "my_id", "share_location", "location", "live_location"),
+    ("live_edit",),
+    ("text", "stop_location"),
+)
+
+
+def user_script(factory: UpdateFactory, user_id: int, partner_id: int, locations: int,
+                live_updates: int = 0) -> List[tuple]:
+    """Обновления одного пользователя в том порядке, в каком он их отправил бы"""
+    script = [
+        ("start", factory.command(user_id, "start")),
+        ("my_id", factory.command(user_id, "my_id")),
+        ("share_location", factory.command(user_id, "share_location", partner_id)),
+    ]
+    script += [("location", factory.location(user_id, step)) for step in range(locations)]
+    if live_updates:
+        live = factory.location(user_id, 0, live_period=3600)
+        script.append(("live_location", live))
+        script += [("live_edit", factory.live_edit(live, step)) for step in range(1, live_updates + 1)]
+    script += [
+        ("text", factory.text(user_id, "Когда будет доставка?")),
+        ("stop_location", factory.command(user_id, "stop_location")),
+    ]
+    return script
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: List[float]) -> dict:
+    return {
+        "updates": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+async def run(args) -> dict:
+    bot = FakeBot(api_latency=args.api_latency / 1000)
+    main.CONCURRENT_UPDATES = args.concurrency
+    main.location_fanout = FanOut(rate=args.send_rate, chat_rate=args.send_rate, chat_burst=args.send_rate)
+    main.live_locations = LiveLocationRelay(main.location_fanout, main.location_sharing_sessions,
+                                            interval=args.live_interval)
+    application = main.build_application(bot=bot)
+    errors: List[BaseException] = []
+
+    async def count_errors(update: object, context: ContextTypes.DEFAULT_TYPE):
+        errors.append(context.error)
+
+    application.add_error_handler(count_errors)
+
+    # Пользователи парами делятся геолокацией друг с другом
+    factory = UpdateFactory()
+    user_ids = [1_000_000 + i for i in range(args.users)]
+    scripts = [
+        user_script(factory, user_id, user_ids[i ^ 1] if (i ^ 1) < len(user_ids) else user_id,
+                    args.locations, args.live_updates)
+        for i, user_id in enumerate(user_ids)
+    ]
+    # Обновления приходят вперемешку от всех пользователей, но у каждого - по порядку
+    arrivals = [item for step in zip_longest(*scripts) for item in step if item is not None]
+    waves = [[(kind, data) for kind, data in arrivals if kind in phase] for phase in PHASES]
+    total = len(arrivals)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def handle(kind: str, update: Update, received: float):
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[kind].append(time.perf_counter() - received)
+
+    await application.initialize()
+    await application.start()
+    try:
+        start = time.perf_counter()
+        for wave in waves:
+            # Как Application при получении обновлений: задача на каждое, порядок и
+            # ограничение параллельности обеспечивает update_processor
+            tasks = [
+                asyncio.create_task(handle(kind, Update.de_json(data, bot), time.perf_counter()))
+                for kind, data in wave
+            ]
+            await asyncio.gather(*tasks)
+            await main.live_locations.drain()
+        elapsed = time.perf_counter() - start
+        # stop() дожидается фоновой рассылки геолокаций (application.create_task)
+        await application.stop()
+        delivered = time.perf_counter() - start
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "users": args.users,
+        "locations": args.locations,
+        "live_updates": args.live_updates,
+        "live_interval_s": args.live_interval,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.api_latency,
+        "updates": total,
+        "elapsed_s": round(elapsed, 3),
+        "delivered_s": round(delivered, 3),
+        "throughput": round(total / elapsed, 1) if elapsed else 0.0,
+        "errors": len(errors),
+        "latency": {"all": summarize(all_latencies), **{kind: summarize(values) for kind, values in latencies.items()}},
+        "api_calls": dict(sorted(bot.calls.items())),
+        "live_edits": bot.calls["editMessageLiveLocation"],
+    }
+
+
+def print_report(report: dict):
+    print(f"Обновлений: {report['updates']} за {report['elapsed_s']} с "
+          f"({report['throughput']} в секунду), ошибок: {report['errors']}; "
+          f"фоновая рассылка закончилась через {report['delivered_s']} с")
+    print(f"{'тип':<16} {'кол-во':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in report["latency"].items():
+        print(f"{kind:<16} {stats['updates']:>8} {stats['p50_ms']:>9.3f} {stats['p90_ms']:>9.3f} "
+              f"{stats['p99_ms']:>9.3f} {stats['max_ms']:>9.3f}")
+    print("Вызовы Bot API: " + ", ".join(f"{name}={calls}" for name, calls in report["api_calls"].items()))
+    if report["live_updates"]:
+        print(f"Правок трансляции (editMessageLiveLocation): {report['live_edits']} "
+              f"на {report['users'] * report['live_updates']} точек")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота без сети")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--locations", type=int, default=3, help="геолокаций от каждого пользователя")
+    parser.add_argument("--live-updates", type=int, default=0,
+                        help="точек трансляции геолокации (правок сообщения) от каждого пользователя")
+    parser.add_argument("--live-interval", type=float, default=0.0,
+                        help="интервал прореживания трансляции, с (по умолчанию 0 - каждая точка)")
+    parser.add_argument("--concurrency", type=int, default=main.CONCURRENT_UPDATES,
+                        help="сколько обновлений разных чатов обрабатывается одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="искусственная задержка Bot API, мс")
+    parser.add_argument("--send-rate", type=float, default=1e9,
+                        help="лимит отправки сообщений в секунду (у Telegram ~30 всего и ~1 в один чат); "
+                             "по умолчанию без ограничений, чтобы мерить сами обработчики")
+    parser.add_argument("--output", type=Path, help="куда сохранить результаты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи обработчиков")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # Обработчики пишут в лог каждое сообщение - на тысячах обновлений это доминирует
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    if args.live_updates and report["live_edits"] < args.users:
+        # У каждого пользователя есть получатель, так что хотя бы одна правка на каждого
+        print(f"❌ Правок трансляции меньше, чем пользователей ({args.users}): relay не дошёл до правок")
+        return 1
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
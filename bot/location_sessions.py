@@ -0,0 +1,106 @@
+"""
+Сессии обмена геолокацией: кто кому отправляет, с индексами в обе стороны
+"""
+from typing import Dict, Iterable, List, Tuple
+
+
+class LocationSessions:
+    """
+    Пары отправитель -> получатель. Один отправитель (например, курьер) может
+    делиться геолокацией со многими получателями, и один получатель может
+    следить за несколькими отправителями.
+
+    Хранятся два индекса: sender -> receivers и receiver -> senders, поэтому
+    поиск, добавление и удаление пары, а также вопрос "кто следит за мной"
+    не требуют перебора всех сессий. Множества - это dict с None, чтобы
+    порядок получателей совпадал с порядком подключения.
+
+    Если задан store (SessionStore), каждое изменение передаётся ему для
+    отложенной записи на диск.
+    """
+
+    def __init__(self, store=None):
+        self._receivers: Dict[int, Dict[int, None]] = {}
+        self._senders: Dict[int, Dict[int, None]] = {}
+        self._pairs = 0
+        self._store = store
+
+    def load(self, pairs: Iterable[Tuple[int, int]]):
+        """Восстанавливает сессии, сохранённые до перезапуска (без повторной записи)"""
+        store, self._store = self._store, None
+        try:
+            for sender_id, receiver_id in pairs:
+                self.add(sender_id, receiver_id)
+        finally:
+            self._store = store
+
+    def _changed(self, sender_id: int, receiver_id: int, active: bool):
+        if self._store is not None:
+            self._store.changed(sender_id, receiver_id, active)
+
+    def add(self, sender_id: int, receiver_id: int) -> bool:
+        """Начинает сессию; False, если она уже есть"""
+        receivers = self._receivers.setdefault(sender_id, {})
+        if receiver_id in receivers:
+            return False
+        receivers[receiver_id] = None
+        self._senders.setdefault(receiver_id, {})[sender_id] = None
+        self._pairs += 1
+        self._changed(sender_id, receiver_id, True)
+        return True
+
+    def remove(self, sender_id: int, receiver_id: int) -> bool:
+        """Завершает одну сессию; False, если её не было"""
+        receivers = self._receivers.get(sender_id)
+        if not receivers or receiver_id not in receivers:
+            return False
+        self._discard(self._receivers, sender_id, receiver_id)
+        self._discard(self._senders, receiver_id, sender_id)
+        self._pairs -= 1
+        self._changed(sender_id, receiver_id, False)
+        return True
+
+    @staticmethod
+    def _discard(index: Dict[int, Dict[int, None]], key: int, value: int):
+        values = index[key]
+        del values[value]
+        if not values:
+            del index[key]
+
+    def stop_sharing(self, sender_id: int) -> List[int]:
+        """Завершает все сессии отправителя, возвращает его получателей"""
+        receivers = list(self._receivers.pop(sender_id, {}))
+        for receiver_id in receivers:
+            self._discard(self._senders, receiver_id, sender_id)
+            self._changed(sender_id, receiver_id, False)
+        self._pairs -= len(receivers)
+        return receivers
+
+    def stop_receiving(self, receiver_id: int) -> List[int]:
+        """Завершает все сессии получателя, возвращает отправителей"""
+        senders = list(self._senders.pop(receiver_id, {}))
+        for sender_id in senders:
+            self._discard(self._receivers, sender_id, receiver_id)
+            self._changed(sender_id, receiver_id, False)
+        self._pairs -= len(senders)
+        return senders
+
+    def receivers(self, sender_id: int) -> List[int]:
+        return list(self._receivers.get(sender_id, ()))
+
+    def senders(self, receiver_id: int) -> List[int]:
+        """Кто делится геолокацией с этим пользователем"""
+        return list(self._senders.get(receiver_id, ()))
+
+    def is_sharing(self, sender_id: int) -> bool:
+        return sender_id in self._receivers
+
+    def is_receiving(self, receiver_id: int) -> bool:
+        return receiver_id in self._senders
+
+    def has(self, sender_id: int, receiver_id: int) -> bool:
+        return receiver_id in self._receivers.get(sender_id, ())
+
+    def __len__(self) -> int:
+        """Количество активных пар"""
+        return self._pairs
@@ -3,12 +3,20 @@
 """
 import os
 import logging
+import secrets
 from pathlib import Path
 from dotenv import load_dotenv
 from telegram import Update, WebAppInfo, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes, CallbackQueryHandler
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from chat_cache import ChatCache
+from fanout import FanOut
+from live_location import LiveLocationRelay
+from location_sessions import LocationSessions
+from session_store import SessionStore
+from update_processor import PerChatUpdateProcessor
+
 # Настройка логирования (сначала, чтобы можно было использовать logger)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -41,9 +49,31 @@ if not env_loaded:
 # Токен бота (получаем из переменных окружения)
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 
-# Хранение активных сессий обмена геолокацией
-# Формат: {sender_id: receiver_id}
-location_sharing_sessions = {}
+# Сколько обновлений разных чатов обрабатывается одновременно
+# (обновления одного чата - всегда по очереди, см. update_processor.py)
+CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', 32))
+
+# Режим получения обновлений: polling (этот процесс сам опрашивает Telegram)
+# или webhook (Telegram присылает обновления на бэкенд, бот работает внутри него)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес бэкенда, на который Telegram будет слать обновления
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = '/telegram/webhook'
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token;
+# если не задан, при каждом запуске создаётся новый
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '') or secrets.token_urlsafe(32)
+
+# Активные сессии обмена геолокацией: отправитель -> получатели и обратно.
+# Сохраняются в SQLite и восстанавливаются при перезапуске
+LOCATION_DB_FILE = Path(os.getenv('LOCATION_DB_FILE', Path(__file__).parent / 'location_sessions.db'))
+session_store = SessionStore(LOCATION_DB_FILE)
+location_sharing_sessions = LocationSessions(store=session_store)
+# Рассылка геолокаций с учётом лимитов Telegram на отправку
+location_fanout = FanOut()
+# Трансляции геолокации в реальном времени (правки сообщения с live location)
+live_locations = LiveLocationRelay(location_fanout, location_sharing_sessions)
+# Имена пользователей для сообщений об обмене геолокацией (без get_chat на каждую команду)
+chat_cache = ChatCache()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -132,7 +162,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             '/menu - Открыть меню\n'
             '/my_id - Узнать свой ID\n'
             '/share_location - Поделиться геолокацией\n'
-            '/stop_location - Остановить обмен геолокацией\n\n'
+            '/stop_location - Остановить обмен геолокацией (или /stop_location <ID> - с одним пользователем)\n\n'
             'Или нажмите кнопку ниже:',
             reply_markup=reply_markup
         )
@@ -174,32 +204,31 @@ async def share_location_command(update: Update, context: ContextTypes.DEFAULT_T
         user = update.message.from_user
         user_id = user.id
         
-        # Проверяем, не делится ли уже пользователь геолокацией
-        if user_id in location_sharing_sessions:
-            receiver_id = location_sharing_sessions[user_id]
-            await update.message.reply_text(
-                f"⚠️ Вы уже делитесь геолокацией с пользователем (ID: {receiver_id})\n\n"
-                f"Используйте /stop_location чтобы остановить обмен."
-            )
-            return
-        
         # Получаем ID получателя из аргументов команды
         if context.args and len(context.args) > 0:
             try:
                 receiver_id = int(context.args[0])
                 
+                # Проверяем, не делится ли уже пользователь геолокацией с этим получателем
+                if location_sharing_sessions.has(user_id, receiver_id):
+                    await update.message.reply_text(
+                        f"⚠️ Вы уже делитесь геолокацией с пользователем (ID: {receiver_id})\n\n"
+                        f"Используйте /stop_location чтобы остановить обмен."
+                    )
+                    return
+                
                 # Проверяем, что получатель существует
                 try:
-                    receiver = await context.bot.get_chat(receiver_id)
-                    receiver_name = receiver.first_name or f"ID: {receiver_id}"
+                    receiver_name = await chat_cache.first_name(context.bot, receiver_id) or f"ID: {receiver_id}"
                 except:
                     await update.message.reply_text(
                         "❌ Не удалось найти получателя. Проверьте правильность ID."
                     )
                     return
                 
-                # Создаем сессию обмена
-                location_sharing_sessions[user_id] = receiver_id
+                # Создаем сессию обмена (получателей может быть несколько)
+                location_sharing_sessions.add(user_id, receiver_id)
+                receivers_count = len(location_sharing_sessions.receivers(user_id))
                 
                 # Создаем клавиатуру с кнопкой для отправки геолокации
                 keyboard = [
@@ -210,8 +239,11 @@ async def share_location_command(update: Update, context: ContextTypes.DEFAULT_T
                 
                 await update.message.reply_text(
                     f"✅ Обмен геолокацией активирован!\n\n"
-                    f"📤 Вы делитесь геолокацией с: {receiver_name}\n\n"
+                    f"📤 Вы делитесь геолокацией с: {receiver_name}\n"
+                    f"👥 Всего получателей: {receivers_count}\n\n"
                     f"📍 Нажмите кнопку ниже, чтобы отправить вашу текущую геолокацию.\n"
+                    f"📡 Чтобы получатели видели вас в движении, отправьте геолокацию в реальном времени "
+                    f"(📎 → Геолокация → Транслировать).\n"
                     f"⏹ Используйте /stop_location чтобы остановить обмен.",
                     reply_markup=reply_markup
                 )
@@ -285,58 +317,77 @@ async def stop_location_command(update: Update, context: ContextTypes.DEFAULT_TY
         if not update.message:
             return
         
-        user_id = update.message.from_user.id
+        user = update.message.from_user
+        user_id = user.id
         
-        if user_id in location_sharing_sessions:
-            receiver_id = location_sharing_sessions[user_id]
-            del location_sharing_sessions[user_id]
-            
-            # Убираем клавиатуру
+        # /stop_location <ID> - остановить обмен только с одним пользователем
+        if context.args:
+            try:
+                other_id = int(context.args[0])
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат ID.\n\n"
+                    "Использование: /stop_location или /stop_location <ID>"
+                )
+                return
+            receivers = [other_id] if location_sharing_sessions.remove(user_id, other_id) else []
+            senders = [other_id] if location_sharing_sessions.remove(other_id, user_id) else []
+        else:
+            receivers = location_sharing_sessions.stop_sharing(user_id)
+            senders = location_sharing_sessions.stop_receiving(user_id)
+        
+        if not receivers and not senders:
             await update.message.reply_text(
-                "⏹ Обмен геолокацией остановлен.",
+                "ℹ️ Вы не делитесь геолокацией и не получаете её.",
                 reply_markup=ReplyKeyboardRemove()
             )
-            
-            # Уведомляем получателя
+            return
+        
+        lines = []
+        if receivers:
+            lines.append(f"⏹ Обмен геолокацией остановлен (получателей: {len(receivers)}).")
+        for sender_id in senders:
+            try:
+                sender_name = await chat_cache.first_name(context.bot, sender_id)
+            except Exception as e:
+                logger.warning(f"Не удалось получить имя отправителя {sender_id}: {e}")
+                sender_name = f"ID: {sender_id}"
+            lines.append(f"⏹ Вы больше не получаете геолокацию от {sender_name}.")
+        
+        # Клавиатура отправки нужна, пока пользователь ещё с кем-то делится
+        reply_markup = None if location_sharing_sessions.is_sharing(user_id) else ReplyKeyboardRemove()
+        await update.message.reply_text("\n".join(lines), reply_markup=reply_markup)
+        
+        # Останавливаем трансляции у тех, кто больше не получает геолокацию
+        if receivers:
+            context.application.create_task(live_locations.detach(context.application, user_id, receivers))
+        for sender_id in senders:
+            context.application.create_task(live_locations.detach(context.application, sender_id, [user_id]))
+        
+        # Уведомляем получателей
+        for receiver_id in receivers:
             try:
-                user_name = update.message.from_user.first_name
                 await context.bot.send_message(
                     receiver_id,
-                    f"⏹ <b>{user_name}</b> остановил обмен геолокацией.",
+                    f"⏹ <b>{user.first_name}</b> остановил обмен геолокацией.",
                     parse_mode='HTML'
                 )
             except Exception as e:
                 logger.warning(f"Не удалось уведомить получателя {receiver_id}: {e}")
-            
-            logger.info(f"⏹ Пользователь {user_id} остановил обмен геолокацией с {receiver_id}")
-        else:
-            # Проверяем, не является ли пользователь получателем
-            sender_id = None
-            for sid, rid in location_sharing_sessions.items():
-                if rid == user_id:
-                    sender_id = sid
-                    break
-            
-            if sender_id:
-                del location_sharing_sessions[sender_id]
-                try:
-                    sender_name = (await context.bot.get_chat(sender_id)).first_name
-                    await update.message.reply_text(
-                        f"⏹ Вы больше не получаете геолокацию от {sender_name}.",
-                        reply_markup=ReplyKeyboardRemove()
-                    )
-                    await context.bot.send_message(
-                        sender_id,
-                        f"⏹ Получатель остановил получение вашей геолокации.",
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    logger.warning(f"Ошибка при остановке получения: {e}")
-            else:
-                await update.message.reply_text(
-                    "ℹ️ Вы не делитесь геолокацией и не получаете её.",
-                    reply_markup=ReplyKeyboardRemove()
+        
+        # Уведомляем отправителей
+        for sender_id in senders:
+            try:
+                await context.bot.send_message(
+                    sender_id,
+                    f"⏹ Получатель <b>{user.first_name}</b> остановил получение вашей геолокации.",
+                    parse_mode='HTML'
                 )
+            except Exception as e:
+                logger.warning(f"Не удалось уведомить отправителя {sender_id}: {e}")
+        
+        logger.info(f"⏹ Пользователь {user_id} остановил обмен геолокацией: "
+                    f"получатели {receivers}, отправители {senders}")
                 
     except Exception as e:
         logger.error(f"Ошибка в stop_location_command: {e}", exc_info=True)
@@ -354,38 +405,21 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         location = update.message.location
         
         # Проверяем, есть ли активная сессия обмена
-        if sender_id in location_sharing_sessions:
-            receiver_id = location_sharing_sessions[sender_id]
-            
-            try:
-                sender_name = update.message.from_user.first_name or "Пользователь"
-                
-                # Отправляем геолокацию получателю
-                await context.bot.send_location(
-                    receiver_id,
-                    latitude=location.latitude,
-                    longitude=location.longitude
-                )
-                
-                # Отправляем текстовое сообщение с координатами
-                await context.bot.send_message(
-                    receiver_id,
-                    f"📍 <b>{sender_name}</b> поделился геолокацией:\n\n"
-                    f"Широта: {location.latitude}\n"
-                    f"Долгота: {location.longitude}",
-                    parse_mode='HTML'
-                )
-                
-                # Подтверждаем отправителю
+        receivers = location_sharing_sessions.receivers(sender_id)
+        if receivers and location.live_period:
+            # Трансляция: дальше точки придут правками этого сообщения
+            await update.message.reply_text("✅ Трансляция геолокации запущена! Получатели видят ваше перемещение.")
+            live_locations.push(context.application, update.message)
+        elif receivers:
+            # Подтверждаем отправителю сразу, доставка получателям идёт в фоне
+            if len(receivers) == 1:
                 await update.message.reply_text("✅ Геолокация отправлена!")
-                
-                logger.info(f"📍 Геолокация от {sender_id} отправлена {receiver_id}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке геолокации: {e}")
-                await update.message.reply_text(
-                    "❌ Не удалось отправить геолокацию. Возможно, получатель заблокировал бота."
-                )
+            else:
+                await update.message.reply_text(f"✅ Геолокация отправляется получателям: {len(receivers)}")
+            context.application.create_task(
+                deliver_location(context, update.message.from_user, location, receivers),
+                update=update
+            )
         else:
             await update.message.reply_text(
                 "ℹ️ У вас нет активной сессии обмена геолокацией.\n"
@@ -396,6 +430,60 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка в handle_location: {e}", exc_info=True)
 
 
+async def handle_live_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик обновления геолокации в реальном времени (правка сообщения)"""
+    try:
+        message = update.edited_message
+        if not message or not message.location:
+            return
+        
+        sender_id = message.from_user.id
+        # Отвечать на каждую точку не нужно: ни отправителю, ни без активной сессии
+        if location_sharing_sessions.is_sharing(sender_id) or live_locations.is_live(sender_id):
+            live_locations.push(context.application, message)
+            
+    except Exception as e:
+        logger.error(f"Ошибка в handle_live_location: {e}", exc_info=True)
+
+
+async def deliver_location(context: ContextTypes.DEFAULT_TYPE, sender, location, receivers):
+    """Рассылает геолокацию всем получателям; о недоставленных сообщает отправителю"""
+    sender_name = sender.first_name or "Пользователь"
+    
+    async def deliver(receiver_id: int):
+        # Отправляем геолокацию получателю
+        await location_fanout.send(receiver_id, lambda: context.bot.send_location(
+            receiver_id,
+            latitude=location.latitude,
+            longitude=location.longitude
+        ))
+        # Отправляем текстовое сообщение с координатами
+        await location_fanout.send(receiver_id, lambda: context.bot.send_message(
+            receiver_id,
+            f"📍 <b>{sender_name}</b> поделился геолокацией:\n\n"
+            f"Широта: {location.latitude}\n"
+            f"Долгота: {location.longitude}",
+            parse_mode='HTML'
+        ))
+    
+    result = await location_fanout.broadcast(receivers, deliver)
+    logger.info(f"📍 Геолокация от {sender.id} отправлена {len(result.delivered)} из {len(receivers)}")
+    if not result.failed:
+        return
+    
+    for receiver_id, error in result.failed.items():
+        logger.error(f"Ошибка при отправке геолокации {receiver_id}: {error}")
+    try:
+        if result.delivered:
+            text = (f"⚠️ Геолокация доставлена {len(result.delivered)} из {len(receivers)} получателей. "
+                    f"Не доставлено: {', '.join(map(str, result.failed))}")
+        else:
+            text = "❌ Не удалось отправить геолокацию. Возможно, получатель заблокировал бота."
+        await location_fanout.send(sender.id, lambda: context.bot.send_message(sender.id, text))
+    except Exception as e:
+        logger.warning(f"Не удалось сообщить отправителю {sender.id} о недоставленной геолокации: {e}")
+
+
 async def handle_stop_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки 'Остановить обмен'"""
     if update.message and update.message.text == "⏹ Остановить обмен":
@@ -415,6 +503,13 @@ async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка в обработчике echo: {e}", exc_info=True)
 
 
+async def remember_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запоминает имя автора любого обновления, чтобы потом не спрашивать get_chat"""
+    user = update.effective_user
+    if user is not None:
+        chat_cache.remember(user.id, user.first_name)
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка при обработке обновления: {context.error}", exc_info=True)
@@ -429,11 +524,96 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def post_init(application: Application) -> None:
     """Вызывается после инициализации бота"""
+    await session_store.start(location_sharing_sessions)
     bot_info = await application.bot.get_me()
     logger.info(f"Бот успешно подключен: @{bot_info.username} (ID: {bot_info.id})")
     logger.info(f"Имя бота: {bot_info.first_name}")
     logger.info("Бот готов к работе и ожидает команды...")
 
+
+async def post_shutdown(application: Application) -> None:
+    """Вызывается при остановке бота"""
+    await session_store.stop()
+
+def build_application(token: str = BOT_TOKEN, bot=None) -> Application:
+    """
+    Создаёт приложение со всеми обработчиками. Вместо токена можно передать
+    готовый бот (например, подменный из load_test.py, который не ходит в сеть).
+    """
+    builder = (
+        Application.builder()
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+    )
+    if bot is not None:
+        builder = builder.bot(bot)
+    else:
+        builder = builder.token(token)
+    application = builder.build()
+    
+    # Регистрируем обработчики
+    logger.info("📝 Регистрация обработчиков команд...")
+    # Группа -1 срабатывает раньше остальных и не мешает им
+    application.add_handler(TypeHandler(Update, remember_user), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("menu", menu_command))
+    application.add_handler(CommandHandler("my_id", my_id_command))
+    application.add_handler(CommandHandler("share_location", share_location_command))
+    application.add_handler(CommandHandler("stop_location", stop_location_command))
+    
+    # Обработчики геолокации (должны быть перед TEXT handler)
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.LOCATION, handle_location))
+    application.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE & filters.LOCATION, handle_live_location))
+    
+    # Обработчик текстовых сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
+    logger.info("✅ Обработчики зарегистрированы")
+    
+    # Регистрируем обработчик ошибок
+    application.add_error_handler(error_handler)
+    logger.info("✅ Обработчик ошибок зарегистрирован")
+    return application
+
+
+async def start_webhook(application: Application) -> None:
+    """
+    Запуск бота в режиме webhook (вызывается бэкендом при старте): обработка
+    обновлений из application.update_queue и регистрация адреса в Telegram
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    
+    if not WEBHOOK_URL:
+        logger.error("❌ WEBHOOK_URL не установлен, Telegram не узнает, куда слать обновления")
+        return
+    webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+    await application.bot.set_webhook(
+        url=webhook_url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True  # Игнорируем старые обновления при запуске
+    )
+    logger.info(f"🔗 Webhook установлен: {webhook_url}")
+
+
+async def stop_webhook(application: Application) -> None:
+    """Снимает webhook и дорабатывает уже полученные обновления (при остановке бэкенда)"""
+    if WEBHOOK_URL:
+        try:
+            await application.bot.delete_webhook()
+            logger.info("🔗 Webhook снят")
+        except Exception as e:
+            logger.warning(f"Не удалось снять webhook: {e}")
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
 def main():
     """Запуск бота"""
     if not BOT_TOKEN:
@@ -446,29 +626,13 @@ def main():
     logger.info(f"BOT_TOKEN установлен: {'✅ Да' if BOT_TOKEN else '❌ Нет'}")
     logger.info(f"WEB_URL: {os.getenv('WEB_URL', 'не установлен')}")
     
+    if BOT_MODE == 'webhook':
+        logger.error("❌ BOT_MODE=webhook: бот запускается вместе с бэкендом (backend/main.py), а не отдельно")
+        return
+    
     try:
         # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
-        
-        # Регистрируем обработчики
-        logger.info("📝 Регистрация обработчиков команд...")
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("menu", menu_command))
-        application.add_handler(CommandHandler("my_id", my_id_command))
-        application.add_handler(CommandHandler("share_location", share_location_command))
-        application.add_handler(CommandHandler("stop_location", stop_location_command))
-        
-        # Обработчик геолокации (должен быть перед TEXT handler)
-        application.add_handler(MessageHandler(filters.LOCATION, handle_location))
-        
-        # Обработчик текстовых сообщений
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
-        logger.info("✅ Обработчики зарегистрированы")
-        
-        # Регистрируем обработчик ошибок
-        application.add_error_handler(error_handler)
-        logger.info("✅ Обработчик ошибок зарегистрирован")
+        application = build_application()
         
         # Запускаем бота
         logger.info("🔄 Запуск polling...")
@@ -484,4 +648,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,121 @@
+"""
+Сохранение сессий обмена геолокацией в SQLite, чтобы они переживали перезапуск бота
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Как часто накопленные изменения сбрасываются на диск, сек
+FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', 1.0))
+# Столько изменений сбрасываются сразу, не дожидаясь FLUSH_INTERVAL
+FLUSH_BATCH = int(os.getenv('LOCATION_FLUSH_BATCH', 500))
+
+
+class SessionStore:
+    """
+    Отложенная запись сессий: изменения копятся в памяти (для одной пары
+    остаётся только последнее - начата или завершена) и раз в FLUSH_INTERVAL
+    записываются одной транзакцией в отдельном потоке. Чтения идут из
+    LocationSessions в памяти, на диск ходит только фоновая задача, поэтому
+    обработка геолокаций диска не касается.
+
+    При старте все сессии читаются одним запросом. Изменения последней
+    секунды перед падением процесса могут потеряться - это приемлемая цена.
+    """
+
+    CREATE = (
+        "CREATE TABLE IF NOT EXISTS location_sessions ("
+        "sender_id INTEGER NOT NULL, receiver_id INTEGER NOT NULL, created_at REAL NOT NULL, "
+        "PRIMARY KEY (sender_id, receiver_id)) WITHOUT ROWID"
+    )
+    SELECT_ALL = "SELECT sender_id, receiver_id FROM location_sessions ORDER BY created_at"
+    INSERT = "INSERT OR IGNORE INTO location_sessions (sender_id, receiver_id, created_at) VALUES (?, ?, ?)"
+    DELETE = "DELETE FROM location_sessions WHERE sender_id = ? AND receiver_id = ?"
+
+    def __init__(self, db_file: Path, flush_interval: float = FLUSH_INTERVAL, flush_batch: int = FLUSH_BATCH):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._conn: Optional[sqlite3.Connection] = None
+        # (отправитель, получатель) -> сессия активна
+        self._pending: Dict[Tuple[int, int], bool] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self) -> List[Tuple[int, int]]:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # NORMAL в WAL не портит базу при падении, теряются только последние транзакции
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(self.CREATE)
+        self._conn = conn
+        return [(sender_id, receiver_id) for sender_id, receiver_id in conn.execute(self.SELECT_ALL)]
+
+    async def start(self, sessions) -> None:
+        """Загружает сохранённые сессии в sessions и запускает фоновую запись"""
+        started = time.perf_counter()
+        pairs = await asyncio.get_running_loop().run_in_executor(None, self._open)
+        sessions.load(pairs)
+        logger.info(f"📍 Загружено сессий геолокации: {len(pairs)} "
+                    f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Записывает всё накопленное и закрывает базу"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._conn.close()
+        self._conn = None
+
+    def changed(self, sender_id: int, receiver_id: int, active: bool) -> None:
+        """Запоминает изменение сессии (пока хранилище не запущено - ничего не делает)"""
+        if self._task is None:
+            return
+        self._pending[(sender_id, receiver_id)] = active
+        if len(self._pending) >= self.flush_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+        await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сессий геолокации: {e}")
+            # Повторим в следующий раз; более новые изменения тех же пар важнее
+            for pair, active in batch.items():
+                self._pending.setdefault(pair, active)
+
+    def _write(self, batch: Dict[Tuple[int, int], bool]):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                self.INSERT, [(sender_id, receiver_id, now) for (sender_id, receiver_id), active in batch.items() if active]
+            )
+            self._conn.executemany(
+                self.DELETE, [pair for pair, active in batch.items() if not active]
+            )
@@ -0,0 +1,80 @@
+"""
+Параллельная обработка обновлений с сохранением порядка внутри одного чата
+"""
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update: object) -> Optional[int]:
+    """Чат (или пользователь, если чата нет), в пределах которого важен порядок"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates), а обновления одного чата - строго по очереди:
+    геолокация не обгонит /share_location, который открыл сессию.
+
+    Очередь чата - цепочка событий: каждое обновление ждёт завершения
+    предыдущего из того же чата и только потом занимает место в семафоре,
+    поэтому ожидающие своей очереди не отнимают места у других чатов.
+    Application создаёт задачи обработки в порядке получения обновлений,
+    а звено цепочки добавляется до первого await - порядок сохраняется.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Чат -> событие завершения последнего поставленного в очередь обновления
+        self._tails: Dict[int, asyncio.Event] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        previous = self._tails.get(key)
+        done = self._tails[key] = asyncio.Event()
+        started = False
+        try:
+            if previous is not None:
+                await previous.wait()
+            started = True
+            await super().process_update(update, coroutine)
+        finally:
+            if not started and asyncio.iscoroutine(coroutine):
+                # Обработку отменили раньше, чем до неё дошла очередь
+                coroutine.close()
+            if not started and not previous.is_set():
+                # Следующие обновления чата всё равно должны дождаться предыдущего
+                asyncio.get_running_loop().create_task(self._release_after(previous, key, done))
+            else:
+                self._release(key, done)
+
+    async def _release_after(self, previous: asyncio.Event, key: int, done: asyncio.Event):
+        await previous.wait()
+        self._release(key, done)
+
+    def _release(self, key: int, done: asyncio.Event):
+        done.set()
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass